@@ -4,12 +4,22 @@ Main application server with 4-layer safety analysis
 """
 
 from fastapi import FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Union
+from datetime import datetime
+from anyio import to_thread
+from cachetools import TTLCache
+import orjson
+import logging
+import threading
 import pandas as pd
 from firewall_engine import PrescriptionFirewall
 
+logger = logging.getLogger(__name__)
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Medical Prescription Firewall",
@@ -26,9 +36,42 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize firewall engine
+# Initialize firewall engine (data is loaded per process on startup)
 firewall = PrescriptionFirewall()
 
+# Worker threads available to the sync (def) endpoints
+THREADPOOL_SIZE = 64
+
+# Serialized profile payloads, keyed by ID (cleared when data reloads)
+PATIENT_CACHE = TTLCache(maxsize=4096, ttl=300)
+PRESCRIBER_CACHE = TTLCache(maxsize=4096, ttl=300)
+_profile_cache_lock = threading.Lock()
+
+
+def cached_profile(cache: TTLCache, key: str, load) -> Optional[bytes]:
+    """Return the JSON payload for a profile, building it on cache miss"""
+    with _profile_cache_lock:
+        payload = cache.get(key)
+    if payload is None:
+        record = load(key)
+        if record is None:
+            return None
+        payload = orjson.dumps(record)
+        with _profile_cache_lock:
+            cache[key] = payload
+    return payload
+
+
+def json_response(content: Any) -> Response:
+    """
+    Serialize a response body with orjson, skipping FastAPI's response
+    model validation; the engine already returns well-formed results.
+    """
+    return Response(
+        content=orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY),
+        media_type="application/json"
+    )
+
 # ============== Pydantic Models ==============
 
 class PrescriptionRequest(BaseModel):
@@ -59,7 +102,13 @@ class AnalysisResponse(BaseModel):
     layer3: LayerResult
     safety_score: int
     reason: str
-    timestamp: str
+    timestamp: datetime
+
+
+class BulkAnalysisError(BaseModel):
+    """Bulk analysis entry for a prescription that could not be analyzed"""
+    error: str
+    request: PrescriptionRequest
 
 
 class PatientProfile(BaseModel):
@@ -85,8 +134,10 @@ class PrescriberProfile(BaseModel):
 
 # ============== Main Endpoints ==============
 
-@app.post("/analyze-prescription", response_model=AnalysisResponse)
-async def analyze_prescription(request: PrescriptionRequest):
+# AnalysisResponse is declared for the API docs only; the engine's result
+# is serialized as is rather than revalidated per response
+@app.post("/analyze-prescription", responses={200: {"model": AnalysisResponse}})
+def analyze_prescription(request: PrescriptionRequest):
     """
     Analyze prescription through 4-layer firewall.
     
@@ -103,37 +154,37 @@ async def analyze_prescription(request: PrescriptionRequest):
             drug=request.drug,
             dose=request.dose
         )
-        return result
+        return json_response(result)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
 @app.get("/patients/{patient_id}")
-async def get_patient(patient_id: str):
+def get_patient(patient_id: str):
     """Get patient profile by ID"""
     try:
-        patient = firewall.get_patient(patient_id)
-        if not patient:
-            raise HTTPException(status_code=404, detail="Patient not found")
-        return patient
+        payload = cached_profile(PATIENT_CACHE, patient_id, firewall.get_patient)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    if payload is None:
+        raise HTTPException(status_code=404, detail="Patient not found")
+    return Response(content=payload, media_type="application/json")
 
 
 @app.get("/prescribers/{prescriber_id}")
-async def get_prescriber(prescriber_id: str):
+def get_prescriber(prescriber_id: str):
     """Get prescriber profile by ID"""
     try:
-        prescriber = firewall.get_prescriber(prescriber_id)
-        if not prescriber:
-            raise HTTPException(status_code=404, detail="Prescriber not found")
-        return prescriber
+        payload = cached_profile(PRESCRIBER_CACHE, prescriber_id, firewall.get_prescriber)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    if payload is None:
+        raise HTTPException(status_code=404, detail="Prescriber not found")
+    return Response(content=payload, media_type="application/json")
 
 
 @app.get("/stats")
-async def get_statistics():
+def get_statistics():
     """Get system statistics"""
     try:
         stats = firewall.get_statistics()
@@ -142,9 +193,8 @@ async def get_statistics():
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@app.post("/bulk-analyze")
-async def bulk_analyze(requests: List[PrescriptionRequest]):
-    """Analyze multiple prescriptions"""
+def analyze_each(requests: List[PrescriptionRequest]) -> List[Dict[str, Any]]:
+    """Analyze prescriptions one by one, reporting failures per item"""
     results = []
     for req in requests:
         try:
@@ -158,11 +208,42 @@ async def bulk_analyze(requests: List[PrescriptionRequest]):
         except Exception as e:
             results.append({
                 "error": str(e),
-                "request": req.dict()
+                "request": req.model_dump()
             })
     return results
 
 
+def analyze_all(requests: List[PrescriptionRequest]) -> List[Dict[str, Any]]:
+    """
+    Analyze a batch with the vectorized engine path. If the batch fails
+    as a whole, fall back to per-item analysis so only the offending
+    items come back as error entries.
+    """
+    try:
+        batch = pd.DataFrame(
+            [req.model_dump() for req in requests],
+            columns=['prescriber_id', 'patient_id', 'drug', 'dose']
+        )
+        return firewall.analyze_batch(batch).to_dict(orient='records')
+    except Exception:
+        # Keep the traceback: a bug in the batch path would otherwise only
+        # show up as a silent slowdown to the per-item path
+        logger.exception("Batch analysis failed; analyzing %d items one by one", len(requests))
+        return analyze_each(requests)
+
+
+# The models are declared for the API docs only; per-item results are
+# serialized as is rather than validated element by element
+@app.post(
+    "/bulk-analyze",
+    responses={200: {"model": List[Union[AnalysisResponse, BulkAnalysisError]]}}
+)
+async def bulk_analyze(requests: List[PrescriptionRequest]):
+    """Analyze multiple prescriptions"""
+    # Run off the event loop so the batch doesn't block other requests
+    return json_response(await run_in_threadpool(analyze_all, requests))
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
@@ -197,10 +278,13 @@ async def root():
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
     """Custom HTTP exception handler"""
-    return {
-        "error": exc.detail,
-        "status_code": exc.status_code
-    }
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={
+            "error": exc.detail,
+            "status_code": exc.status_code
+        }
+    )
 
 
 # ============== Startup/Shutdown Events ==============
@@ -210,7 +294,11 @@ async def startup_event():
     """Initialize on startup"""
     print("🚀 Medical Prescription Firewall API Starting...")
     print("📊 Loading prescriber and patient data...")
+    to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
     firewall.initialize()
+    with _profile_cache_lock:
+        PATIENT_CACHE.clear()
+        PRESCRIBER_CACHE.clear()
     print("✅ System Ready!")
 
 
@@ -223,19 +311,32 @@ async def shutdown_event():
 # ============== Main ==============
 
 if __name__ == "__main__":
+    import os
     import uvicorn
     
+    # One worker by default: each worker process keeps its own engine and
+    # counters, so /stats only reflects the worker that serves it. Set
+    # WEB_CONCURRENCY to scale across cores.
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    
     print("=" * 50)
     print("Medical Prescription Firewall - Backend Server")
     print("=" * 50)
     print("🏥 Healthcare Safety System")
     print("📍 Starting on http://0.0.0.0:8000")
     print("📚 API Docs: http://localhost:8000/docs")
+    print(f"⚙️ Workers: {workers}")
     print("=" * 50)
     
+    # Import string is required for workers > 1; each worker process
+    # loads the rosters in its own startup event. "auto" picks uvloop
+    # and httptools when they are installed.
     uvicorn.run(
-        app,
+        "app:app",
         host="0.0.0.0",
         port=8000,
+        workers=workers,
+        loop="auto",
+        http="auto",
         log_level="info"
     )
@@ -0,0 +1,21 @@
+"""
+Convert the Excel rosters to Parquet.
+
+Run once after editing the .xlsx files; streamlit_app.py and
+firewall_engine.py read the Parquet copies while they are up to date.
+"""
+
+from data_io import read_excel
+
+ROSTERS = ['medical_prescribers_50', 'medical_patients_100']
+
+
+def main():
+    for name in ROSTERS:
+        df = read_excel(f"{name}.xlsx")
+        df.to_parquet(f"{name}.parquet", engine='pyarrow', compression='zstd')
+        print(f"✅ Wrote {name}.parquet ({len(df)} rows)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+"""
+Roster I/O helpers shared by the engine, the dashboard and the Parquet
+conversion script.
+"""
+
+import pandas as pd
+
+
+def read_excel(path: str, **kwargs) -> pd.DataFrame:
+    """Read an .xlsx file with the Rust calamine parser, or openpyxl if it is not installed"""
+    try:
+        return pd.read_excel(path, engine='calamine', **kwargs)
+    except ImportError:
+        return pd.read_excel(path, **kwargs)
+
+
+def to_categorical(df: pd.DataFrame, columns) -> pd.DataFrame:
+    """Convert the given columns (where present) to category dtype"""
+    for col in columns:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    return df
@@ -7,10 +7,318 @@ Layer 2: Drug Safety
 Layer 3: Contraindication Detection
 """
 
+import functools
+import os
+import tempfile
+import threading
+import numpy as np
 import pandas as pd
 from datetime import datetime
 from typing import Dict, List, Optional, Any
 import json
+from data_io import read_excel, to_categorical
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+# Keys derived at load time; not part of the raw patient record
+_DERIVED_PATIENT_KEYS = frozenset({
+    'conditions_list', 'medications_list',
+    'conditions_set', 'medications_set',
+    'liver_status_n', 'kidney_status_n', 'has_kidney_disease'
+})
+
+# Roster sources and their Parquet caches
+PRESCRIBERS_XLSX = 'medical_prescribers_50.xlsx'
+PRESCRIBERS_PARQUET = 'medical_prescribers_50.parquet'
+PATIENTS_XLSX = 'medical_patients_100.xlsx'
+PATIENTS_PARQUET = 'medical_patients_100.parquet'
+
+# Columns kept in the roster DataFrames scanned by the batch layers; the
+# per-ID records (and so the profile endpoints) keep every column
+_PRESCRIBER_COLUMNS = [
+    'doctor_id', 'name', 'credentialing_status', 'dea_number',
+    'status_active', 'dea_valid'
+]
+_PATIENT_COLUMNS = [
+    'patient_id', 'name', 'age', 'conditions', 'medications',
+    'liver_status', 'kidney_status'
+]
+
+# Low-cardinality / key columns stored as pandas Categorical
+_PRESCRIBER_CATEGORY_COLUMNS = ('doctor_id', 'credentialing_status')
+_PATIENT_CATEGORY_COLUMNS = ('patient_id', 'liver_status', 'kidney_status')
+
+# Prescriber flags derived at load time
+_DERIVED_PRESCRIBER_KEYS = frozenset({'status_active', 'dea_valid'})
+
+# Integer encodings used by the batch Layer 3 kernel
+_LAYER3_DRUG_CODES = {
+    'oxycodone': 1, 'morphine': 2, 'hydrocodone': 3, 'codeine': 4,
+    'aspirin': 10, 'ibuprofen': 11, 'metformin': 12
+}
+_STATUS_CODES = {'impaired': 1, 'severe': 2}
+_CONDITION_KIDNEY_DISEASE = 1
+_MEDICATION_WARFARIN = 1
+
+# Layer 3 contraindications by reason code (0 = none)
+_CONTRAINDICATIONS = {
+    1: (
+        "CONTRAINDICATION: {drug} contraindicated with {liver_status} liver disease",
+        {"reason": "opioids_liver_disease", "severity": "CRITICAL"}
+    ),
+    2: (
+        "CONTRAINDICATION: {drug} contraindicated with severe kidney disease",
+        {"reason": "opioids_kidney_disease", "severity": "CRITICAL"}
+    ),
+    3: (
+        "CONTRAINDICATION: NSAIDs contraindicated with kidney disease",
+        {"reason": "nsaid_kidney_disease", "severity": "HIGH"}
+    ),
+    4: (
+        "CONTRAINDICATION: Aspirin-Warfarin interaction (bleeding risk)",
+        {"reason": "drug_drug_interaction", "severity": "CRITICAL", "interaction": "aspirin_warfarin"}
+    ),
+    5: (
+        "CONTRAINDICATION: Metformin contraindicated with kidney impairment",
+        {"reason": "metformin_kidney_disease", "severity": "HIGH"}
+    ),
+}
+
+# Illegal drugs (Layer 2)
+_ILLEGAL_DRUGS = frozenset({'heroin', 'fentanyl_street', 'meth', 'cocaine', 'pcp'})
+
+# Safe dosage limits in mg (Layer 2)
+_SAFE_DOSE_LIMITS = {
+    'oxycodone': 50,
+    'morphine': 100,
+    'hydrocodone': 40,
+    'codeine': 60,
+    'paracetamol': 1000,
+    'ibuprofen': 800,
+    'aspirin': 500,
+    'metformin': 2550,
+    'lisinopril': 40,
+    'atenolol': 100,
+    'vitamin_d': 4000,
+    'atorvastatin': 80,
+    'amlodipine': 10,
+    'albuterol': 200,
+    'insulin': 300
+}
+
+# Fields of an analysis result, in response order
+_RESULT_KEYS = (
+    'approved', 'prescriber_id', 'patient_id', 'drug', 'dose',
+    'layer0', 'layer1', 'layer2', 'layer3',
+    'safety_score', 'reason', 'timestamp'
+)
+
+# Safety score reported for each failing layer (index 4 = all passed)
+_SAFETY_SCORES = (0, 25, 50, 25, 100)
+
+_APPROVED_REASON = "✅ APPROVED - All 4 layers passed"
+
+# Placeholder results for layers skipped after an earlier failure.
+# Shared by reference across responses; never mutate them.
+_SKIP_L0 = {"passed": False, "message": "Skipped - Layer 0 failed"}
+_SKIP_L1 = {"passed": False, "message": "Skipped - Layer 1 failed"}
+_SKIP_L2 = {"passed": False, "message": "Skipped - Layer 2 failed"}
+_SKIPPED = (_SKIP_L0, _SKIP_L1, _SKIP_L2)
+
+# Drug classes used by Layer 3
+_OPIOIDS = frozenset({'oxycodone', 'morphine', 'hydrocodone', 'codeine'})
+_NSAIDS = frozenset({'aspirin', 'ibuprofen'})
+
+
+def _source_mtimes() -> Optional[tuple]:
+    """Modification times of the roster files, or None if one is missing"""
+    try:
+        return (os.path.getmtime(PRESCRIBERS_XLSX), os.path.getmtime(PATIENTS_XLSX))
+    except OSError:
+        return None
+
+
+def _load_table(xlsx_path: str, parquet_path: str) -> pd.DataFrame:
+    """
+    Load a table from its Parquet cache, rebuilding the cache from the
+    Excel source when it is missing, older than the .xlsx file, or
+    unreadable. A Parquet file shipped without its .xlsx is used as is.
+    Uses Arrow-backed dtypes.
+    """
+    if os.path.exists(parquet_path) and (
+        not os.path.exists(xlsx_path)
+        or os.path.getmtime(parquet_path) >= os.path.getmtime(xlsx_path)
+    ):
+        try:
+            return pd.read_parquet(parquet_path, engine='pyarrow', dtype_backend='pyarrow')
+        except Exception as e:
+            print(f"⚠️ Rebuilding Parquet cache {parquet_path}: {e}")
+    
+    df = read_excel(xlsx_path, dtype_backend='pyarrow')
+    # Write to a temporary file and rename it into place, so concurrent
+    # loaders (e.g. several server workers) never read a half-written cache
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(parquet_path)), suffix='.tmp'
+        )
+        os.close(fd)
+        df.to_parquet(tmp_path, engine='pyarrow', compression='zstd')
+        os.replace(tmp_path, parquet_path)
+    except Exception as e:
+        print(f"⚠️ Could not write Parquet cache {parquet_path}: {e}")
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return df
+
+
+def _index_records(df: pd.DataFrame, key: str) -> Dict[str, Dict[str, Any]]:
+    """Map each ID to its row as a plain dict (first row wins on duplicates)"""
+    df = df.drop_duplicates(subset=key)
+    # Missing cells become None rather than NaN
+    df = df.astype(object).where(df.notna(), None)
+    return df.set_index(key, drop=False).to_dict(orient='index')
+
+
+def _layer3_kernel(drug_codes, liver_codes, kidney_codes, condition_bits, medication_bits):
+    """
+    Layer 3 rules over encoded arrays; returns a reason code per row
+    (0 = passed). Must stay in sync with layer3_contraindication_detection
+    (checked by tests/test_firewall_engine.py).
+    """
+    n = drug_codes.shape[0]
+    reasons = np.zeros(n, dtype=np.int8)
+    for i in range(n):
+        drug = drug_codes[i]
+        opioid = 1 <= drug <= 4
+        if opioid and liver_codes[i] >= 1:
+            reasons[i] = 1
+        elif opioid and kidney_codes[i] == 2:
+            reasons[i] = 2
+        elif (drug == 10 or drug == 11) and condition_bits[i] & _CONDITION_KIDNEY_DISEASE:
+            reasons[i] = 3
+        elif drug == 10 and medication_bits[i] & _MEDICATION_WARFARIN:
+            reasons[i] = 4
+        elif drug == 12 and kidney_codes[i] >= 1:
+            reasons[i] = 5
+    return reasons
+
+
+if HAS_NUMBA:
+    # Serial: bulk batches are far too small to repay thread start-up
+    _layer3_kernel = njit(cache=True)(_layer3_kernel)
+
+
+def _warm_layer3_kernel():
+    """
+    Compile (or load from cache) the kernel so no request pays for it.
+    If numba cannot compile it, fall back to the plain Python kernel.
+    """
+    global _layer3_kernel
+    empty = np.zeros(1, dtype=np.int64)
+    try:
+        _layer3_kernel(empty, empty, empty, empty, empty)
+    except Exception as e:
+        if not hasattr(_layer3_kernel, 'py_func'):
+            raise
+        print(f"⚠️ Could not compile the Layer 3 kernel, using Python: {e}")
+        _layer3_kernel = _layer3_kernel.py_func
+
+
+def _make_response(
+    approved: bool,
+    prescriber_id: str,
+    patient_id: str,
+    drug: str,
+    dose: float,
+    layer0: Dict[str, Any],
+    layer1: Dict[str, Any],
+    layer2: Dict[str, Any],
+    layer3: Dict[str, Any],
+    safety_score: int,
+    reason: str
+) -> Dict[str, Any]:
+    """Assemble an analysis result; the caller adds the timestamp"""
+    return {
+        "approved": approved,
+        "prescriber_id": prescriber_id,
+        "patient_id": patient_id,
+        "drug": drug,
+        "dose": dose,
+        "layer0": layer0,
+        "layer1": layer1,
+        "layer2": layer2,
+        "layer3": layer3,
+        "safety_score": safety_score,
+        "reason": reason
+    }
+
+
+def _contraindication_result(code: int, drug: str, patient_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the Layer 3 result for a reason code"""
+    if code == 0:
+        return {
+            "passed": True,
+            "message": "No contraindications detected",
+            "details": {
+                "checked": True,
+                "conditions": patient_data['conditions_list'],
+                "status": "safe"
+            }
+        }
+    
+    message, details = _CONTRAINDICATIONS[code]
+    return {
+        "passed": False,
+        "message": message.format(drug=drug, liver_status=patient_data['liver_status_n']),
+        "details": dict(details)
+    }
+
+
+def _prescriber_details(prescriber_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Layer 0 details for an authorized prescriber"""
+    return {
+        "name": prescriber_data['name'],
+        "specialty": prescriber_data['specialty'],
+        "status": prescriber_data['credentialing_status'],
+        "dea_number": prescriber_data['dea_number']
+    }
+
+
+def _patient_details(patient_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Layer 1 details for a patient found in the database"""
+    return {
+        "name": patient_data['name'],
+        "age": patient_data['age'],
+        "conditions": patient_data['conditions_list'],
+        "medications": patient_data['medications_list'],
+        "liver_status": patient_data.get('liver_status', 'normal'),
+        "kidney_status": patient_data.get('kidney_status', 'normal')
+    }
+
+
+def _normalize_status(value) -> str:
+    """Lowercase an organ status, treating missing values as 'normal'"""
+    if value is None:
+        return 'normal'
+    return str(value).strip().lower()
+
+
+def _split_field(value) -> List[str]:
+    """
+    Split a ';'-separated field into normalized (stripped, lowercase) items.
+    
+    Items are stripped so that every entry is checked, not just the first
+    ("ckd_stage3; kidney_disease" lists kidney_disease).
+    """
+    if value is None:
+        return []
+    return [item.strip().lower() for item in str(value).split(';') if item.strip()]
+
 
 class PrescriptionFirewall:
     """
@@ -19,25 +327,115 @@ class PrescriptionFirewall:
     """
     
     def __init__(self):
-        """Initialize firewall with prescriber and patient data"""
+        """Initialize firewall state; call initialize() to load data"""
         self.prescribers_df = None
         self.patients_df = None
+        self.prescribers_by_id: Dict[str, Dict[str, Any]] = {}
+        self.patients_by_id: Dict[str, Dict[str, Any]] = {}
+        self._patient_codes = None
         self.analysis_count = 0
         self.approved_count = 0
-        self.initialize()
+        # Endpoints run on a threadpool, so counter updates take a lock
+        self._stats_lock = threading.Lock()
+        self._total_prescribers = 0
+        self._total_patients = 0
+        self._initialized = False
+        self._source_mtimes = None
+        # Analyses are deterministic for a given data load
+        self._analyze_cached = functools.lru_cache(maxsize=10_000)(self._run_layers)
     
     def initialize(self):
-        """Load prescriber and patient data"""
+        """
+        Load prescriber and patient data.
+        
+        Safe to call repeatedly: returns immediately when data is already
+        loaded and the roster files have not changed since.
+        """
+        mtimes = _source_mtimes()
+        if self._initialized and mtimes == self._source_mtimes:
+            return
+        
+        self._analyze_cached.cache_clear()
         try:
             # Load prescriber data
-            self.prescribers_df = pd.read_excel('medical_prescribers_50.xlsx')
+            self.prescribers_df = to_categorical(
+                _load_table(PRESCRIBERS_XLSX, PRESCRIBERS_PARQUET),
+                _PRESCRIBER_CATEGORY_COLUMNS
+            )
             # Load patient data
-            self.patients_df = pd.read_excel('medical_patients_100.xlsx')
+            self.patients_df = to_categorical(
+                _load_table(PATIENTS_XLSX, PATIENTS_PARQUET),
+                _PATIENT_CATEGORY_COLUMNS
+            )
+            self._build_indexes()
+            # Records hold the full rows; the frames keep only scanned columns
+            self.prescribers_df = self.prescribers_df[_PRESCRIBER_COLUMNS]
+            self.patients_df = self.patients_df[_PATIENT_COLUMNS]
+            self._total_prescribers = len(self.prescribers_df)
+            self._total_patients = len(self.patients_df)
+            self._source_mtimes = mtimes
+            self._initialized = True
             print("✅ Data loaded successfully")
         except Exception as e:
             print(f"⚠️ Error loading data: {e}")
             self.prescribers_df = None
             self.patients_df = None
+            self.prescribers_by_id = {}
+            self.patients_by_id = {}
+            self._patient_codes = None
+            self._total_prescribers = 0
+            self._total_patients = 0
+            self._initialized = False
+            return
+        
+        # Outside the try: a kernel problem must not discard the loaded data
+        _warm_layer3_kernel()
+    
+    def _build_indexes(self):
+        """
+        Build ID -> record dicts so each layer does a single O(1) lookup
+        instead of a boolean-mask scan over the DataFrame.
+        """
+        # Precompute Layer 0 checks as boolean columns
+        prescribers = self.prescribers_df
+        prescribers['status_active'] = prescribers['credentialing_status'].eq('Active').fillna(False).astype(bool)
+        prescribers['dea_valid'] = (
+            prescribers['dea_number'].astype('string').str.startswith('A').fillna(False).astype(bool)
+        )
+        
+        self.prescribers_by_id = _index_records(prescribers, 'doctor_id')
+        self.patients_by_id = _index_records(self.patients_df, 'patient_id')
+        
+        # Pre-split conditions/medications once instead of on every request,
+        # and precompute the sets/flags Layer 3 tests against
+        for record in self.patients_by_id.values():
+            conditions = _split_field(record.get('conditions'))
+            medications = _split_field(record.get('medications'))
+            record['conditions_list'] = conditions
+            record['medications_list'] = medications
+            record['conditions_set'] = frozenset(conditions)
+            record['medications_set'] = frozenset(medications)
+            record['liver_status_n'] = _normalize_status(record.get('liver_status'))
+            record['kidney_status_n'] = _normalize_status(record.get('kidney_status'))
+            record['has_kidney_disease'] = (
+                'kidney_disease' in record['conditions_set']
+                or any('ckd' in c for c in conditions)
+            )
+        
+        # Encoded Layer 3 features for the batch kernel
+        self._patient_codes = pd.DataFrame.from_dict(
+            {
+                pid: {
+                    'liver': _STATUS_CODES.get(record['liver_status_n'], 0),
+                    'kidney': _STATUS_CODES.get(record['kidney_status_n'], 0),
+                    'conditions': _CONDITION_KIDNEY_DISEASE if record['has_kidney_disease'] else 0,
+                    'medications': _MEDICATION_WARFARIN if 'warfarin' in record['medications_set'] else 0
+                }
+                for pid, record in self.patients_by_id.items()
+            },
+            orient='index',
+            columns=['liver', 'kidney', 'conditions', 'medications']
+        )
     
     # ============== LAYER 0: Doctor Authorization ==============
     
@@ -60,21 +458,17 @@ class PrescriptionFirewall:
                 }
             
             # Find prescriber
-            prescriber = self.prescribers_df[
-                self.prescribers_df['doctor_id'] == prescriber_id
-            ]
+            prescriber_data = self.prescribers_by_id.get(prescriber_id)
             
-            if prescriber.empty:
+            if prescriber_data is None:
                 return {
                     "passed": False,
                     "message": f"Prescriber {prescriber_id} not found in database",
                     "details": {}
                 }
             
-            prescriber_data = prescriber.iloc[0]
-            
             # Check status
-            if prescriber_data['credentialing_status'] != 'Active':
+            if not prescriber_data['status_active']:
                 return {
                     "passed": False,
                     "message": f"Prescriber status: {prescriber_data['credentialing_status']}",
@@ -85,7 +479,7 @@ class PrescriptionFirewall:
                 }
             
             # Check DEA number validity
-            if not str(prescriber_data['dea_number']).startswith('A'):
+            if not prescriber_data['dea_valid']:
                 return {
                     "passed": False,
                     "message": "Invalid DEA number format",
@@ -95,12 +489,7 @@ class PrescriptionFirewall:
             return {
                 "passed": True,
                 "message": f"Prescriber {prescriber_data['name']} authorized",
-                "details": {
-                    "name": prescriber_data['name'],
-                    "specialty": prescriber_data['specialty'],
-                    "status": prescriber_data['credentialing_status'],
-                    "dea_number": prescriber_data['dea_number']
-                }
+                "details": _prescriber_details(prescriber_data)
             }
         
         except Exception as e:
@@ -130,34 +519,19 @@ class PrescriptionFirewall:
                 }
             
             # Find patient
-            patient = self.patients_df[
-                self.patients_df['patient_id'] == patient_id
-            ]
+            patient_data = self.patients_by_id.get(patient_id)
             
-            if patient.empty:
+            if patient_data is None:
                 return {
                     "passed": False,
                     "message": f"Patient {patient_id} not found",
                     "details": {}
                 }
             
-            patient_data = patient.iloc[0]
-            
-            # Extract conditions and medications
-            conditions = str(patient_data.get('conditions', '')).split(';') if pd.notna(patient_data.get('conditions')) else []
-            medications = str(patient_data.get('medications', '')).split(';') if pd.notna(patient_data.get('medications')) else []
-            
             return {
                 "passed": True,
                 "message": f"Patient {patient_data['name']} found",
-                "details": {
-                    "name": patient_data['name'],
-                    "age": patient_data['age'],
-                    "conditions": conditions,
-                    "medications": medications,
-                    "liver_status": patient_data.get('liver_status', 'normal'),
-                    "kidney_status": patient_data.get('kidney_status', 'normal')
-                }
+                "details": _patient_details(patient_data)
             }
         
         except Exception as e:
@@ -178,33 +552,11 @@ class PrescriptionFirewall:
         - Dosage is within safe limits
         - Drug is not on banned list
         """
-        # List of illegal drugs
-        illegal_drugs = ['heroin', 'fentanyl_street', 'meth', 'cocaine', 'pcp']
-        
-        # Safe dosage limits (mg)
-        safe_dose_limits = {
-            'oxycodone': 50,
-            'morphine': 100,
-            'hydrocodone': 40,
-            'codeine': 60,
-            'paracetamol': 1000,
-            'ibuprofen': 800,
-            'aspirin': 500,
-            'metformin': 2550,
-            'lisinopril': 40,
-            'atenolol': 100,
-            'vitamin_d': 4000,
-            'atorvastatin': 80,
-            'amlodipine': 10,
-            'albuterol': 200,
-            'insulin': 300
-        }
-        
         try:
             drug_lower = drug.lower().strip()
             
             # Check if illegal
-            if drug_lower in illegal_drugs:
+            if drug_lower in _ILLEGAL_DRUGS:
                 return {
                     "passed": False,
                     "message": f"Drug '{drug}' is illegal/controlled substance",
@@ -212,18 +564,17 @@ class PrescriptionFirewall:
                 }
             
             # Check dosage limit if known
-            if drug_lower in safe_dose_limits:
-                max_dose = safe_dose_limits[drug_lower]
-                if dose > max_dose:
-                    return {
-                        "passed": False,
-                        "message": f"Dose {dose}mg exceeds safe limit of {max_dose}mg",
-                        "details": {
-                            "drug": drug,
-                            "dose": dose,
-                            "max_safe_dose": max_dose
-                        }
+            max_dose = _SAFE_DOSE_LIMITS.get(drug_lower)
+            if max_dose is not None and dose > max_dose:
+                return {
+                    "passed": False,
+                    "message": f"Dose {dose}mg exceeds safe limit of {max_dose}mg",
+                    "details": {
+                        "drug": drug,
+                        "dose": dose,
+                        "max_safe_dose": max_dose
                     }
+                }
             
             return {
                 "passed": True,
@@ -268,94 +619,46 @@ class PrescriptionFirewall:
                 }
             
             # Get patient data
-            patient = self.patients_df[
-                self.patients_df['patient_id'] == patient_id
-            ]
+            patient_data = self.patients_by_id.get(patient_id)
             
-            if patient.empty:
+            if patient_data is None:
                 return {
                     "passed": True,
                     "message": "Patient not found for contraindication check",
                     "details": {}
                 }
             
-            patient_data = patient.iloc[0]
-            conditions = str(patient_data.get('conditions', '')).lower().split(';')
-            medications = str(patient_data.get('medications', '')).lower().split(';')
-            liver_status = str(patient_data.get('liver_status', 'normal')).lower()
-            kidney_status = str(patient_data.get('kidney_status', 'normal')).lower()
+            medications = patient_data['medications_set']
+            liver_status = patient_data['liver_status_n']
+            kidney_status = patient_data['kidney_status_n']
             
             drug_lower = drug.lower().strip()
             
+            code = 0
+            
             # ===== OPIOID CONTRAINDICATIONS =====
-            if drug_lower in ['oxycodone', 'morphine', 'hydrocodone', 'codeine']:
+            if drug_lower in _OPIOIDS:
                 # Check severe liver disease
-                if liver_status in ['severe', 'impaired']:
-                    return {
-                        "passed": False,
-                        "message": f"CONTRAINDICATION: {drug} contraindicated with {liver_status} liver disease",
-                        "details": {
-                            "reason": "opioids_liver_disease",
-                            "severity": "CRITICAL"
-                        }
-                    }
-                
+                if liver_status in ('severe', 'impaired'):
+                    code = 1
                 # Check kidney impairment
-                if kidney_status == 'severe':
-                    return {
-                        "passed": False,
-                        "message": f"CONTRAINDICATION: {drug} contraindicated with severe kidney disease",
-                        "details": {
-                            "reason": "opioids_kidney_disease",
-                            "severity": "CRITICAL"
-                        }
-                    }
+                elif kidney_status == 'severe':
+                    code = 2
             
             # ===== ASPIRIN CONTRAINDICATIONS =====
-            if drug_lower in ['aspirin', 'ibuprofen']:
-                if 'kidney_disease' in conditions or 'ckd' in str(conditions):
-                    return {
-                        "passed": False,
-                        "message": f"CONTRAINDICATION: NSAIDs contraindicated with kidney disease",
-                        "details": {
-                            "reason": "nsaid_kidney_disease",
-                            "severity": "HIGH"
-                        }
-                    }
+            if not code and drug_lower in _NSAIDS and patient_data['has_kidney_disease']:
+                code = 3
             
             # ===== DRUG-DRUG INTERACTIONS =====
             # Warfarin + Aspirin
-            if drug_lower == 'aspirin' and 'warfarin' in medications:
-                return {
-                    "passed": False,
-                    "message": "CONTRAINDICATION: Aspirin-Warfarin interaction (bleeding risk)",
-                    "details": {
-                        "reason": "drug_drug_interaction",
-                        "severity": "CRITICAL",
-                        "interaction": "aspirin_warfarin"
-                    }
-                }
+            if not code and drug_lower == 'aspirin' and 'warfarin' in medications:
+                code = 4
             
             # Metformin + Kidney disease
-            if drug_lower == 'metformin' and kidney_status in ['impaired', 'severe']:
-                return {
-                    "passed": False,
-                    "message": "CONTRAINDICATION: Metformin contraindicated with kidney impairment",
-                    "details": {
-                        "reason": "metformin_kidney_disease",
-                        "severity": "HIGH"
-                    }
-                }
+            if not code and drug_lower == 'metformin' and kidney_status in ('impaired', 'severe'):
+                code = 5
             
-            return {
-                "passed": True,
-                "message": "No contraindications detected",
-                "details": {
-                    "checked": True,
-                    "conditions": conditions,
-                    "status": "safe"
-                }
-            }
+            return _contraindication_result(code, drug, patient_data)
         
         except Exception as e:
             return {
@@ -377,150 +680,254 @@ class PrescriptionFirewall:
         Full 4-layer prescription analysis.
         
         Returns decision and detailed layer-by-layer results.
+        Repeat queries are served from an LRU cache; the nested layer
+        results are shared between calls and must not be mutated.
         """
-        self.analysis_count += 1
+        result = self._analyze_cached(prescriber_id, patient_id, drug, dose)
+        self._record_analyses(1, 1 if result["approved"] else 0)
+        
+        return {**result, "timestamp": datetime.now()}
+    
+    def _run_layers(
+        self,
+        prescriber_id: str,
+        patient_id: str,
+        drug: str,
+        dose: float
+    ) -> Dict[str, Any]:
+        """Run all 4 layers; result is cached, so it carries no timestamp"""
+        request = (prescriber_id, patient_id, drug, dose)
         
         # Layer 0: Doctor Authorization
         layer0 = self.layer0_doctor_authorization(prescriber_id)
         if not layer0["passed"]:
-            return {
-                "approved": False,
-                "prescriber_id": prescriber_id,
-                "patient_id": patient_id,
-                "drug": drug,
-                "dose": dose,
-                "layer0": layer0,
-                "layer1": {"passed": False, "message": "Skipped - Layer 0 failed"},
-                "layer2": {"passed": False, "message": "Skipped - Layer 0 failed"},
-                "layer3": {"passed": False, "message": "Skipped - Layer 0 failed"},
-                "safety_score": 0,
-                "reason": layer0["message"],
-                "timestamp": datetime.now().isoformat()
-            }
+            return _make_response(
+                False, *request, layer0, _SKIP_L0, _SKIP_L0, _SKIP_L0,
+                _SAFETY_SCORES[0], layer0["message"]
+            )
         
         # Layer 1: Patient Validation
         layer1 = self.layer1_patient_validation(patient_id)
         if not layer1["passed"]:
-            return {
-                "approved": False,
-                "prescriber_id": prescriber_id,
-                "patient_id": patient_id,
-                "drug": drug,
-                "dose": dose,
-                "layer0": layer0,
-                "layer1": layer1,
-                "layer2": {"passed": False, "message": "Skipped - Layer 1 failed"},
-                "layer3": {"passed": False, "message": "Skipped - Layer 1 failed"},
-                "safety_score": 25,
-                "reason": layer1["message"],
-                "timestamp": datetime.now().isoformat()
-            }
+            return _make_response(
+                False, *request, layer0, layer1, _SKIP_L1, _SKIP_L1,
+                _SAFETY_SCORES[1], layer1["message"]
+            )
         
         # Layer 2: Drug Safety
         layer2 = self.layer2_drug_safety(drug, dose)
         if not layer2["passed"]:
-            return {
-                "approved": False,
-                "prescriber_id": prescriber_id,
-                "patient_id": patient_id,
-                "drug": drug,
-                "dose": dose,
-                "layer0": layer0,
-                "layer1": layer1,
-                "layer2": layer2,
-                "layer3": {"passed": False, "message": "Skipped - Layer 2 failed"},
-                "safety_score": 50,
-                "reason": layer2["message"],
-                "timestamp": datetime.now().isoformat()
-            }
+            return _make_response(
+                False, *request, layer0, layer1, layer2, _SKIP_L2,
+                _SAFETY_SCORES[2], layer2["message"]
+            )
         
         # Layer 3: Contraindication Detection
         layer3 = self.layer3_contraindication_detection(patient_id, drug, dose)
         if not layer3["passed"]:
-            return {
-                "approved": False,
-                "prescriber_id": prescriber_id,
-                "patient_id": patient_id,
-                "drug": drug,
-                "dose": dose,
-                "layer0": layer0,
-                "layer1": layer1,
-                "layer2": layer2,
-                "layer3": layer3,
-                "safety_score": 25,
-                "reason": layer3["message"],
-                "timestamp": datetime.now().isoformat()
-            }
+            return _make_response(
+                False, *request, layer0, layer1, layer2, layer3,
+                _SAFETY_SCORES[3], layer3["message"]
+            )
         
         # ALL LAYERS PASSED - APPROVED
-        self.approved_count += 1
+        return _make_response(
+            True, *request, layer0, layer1, layer2, layer3,
+            _SAFETY_SCORES[4], _APPROVED_REASON
+        )
+    
+    # ============== BATCH ANALYSIS ==============
+    
+    def analyze_batch(self, batch: pd.DataFrame) -> pd.DataFrame:
+        """
+        Vectorized 4-layer analysis of many prescriptions at once.
         
-        return {
-            "approved": True,
-            "prescriber_id": prescriber_id,
-            "patient_id": patient_id,
-            "drug": drug,
-            "dose": dose,
-            "layer0": layer0,
-            "layer1": layer1,
-            "layer2": layer2,
-            "layer3": layer3,
-            "safety_score": 100,
-            "reason": "✅ APPROVED - All 4 layers passed",
-            "timestamp": datetime.now().isoformat()
-        }
+        Expects columns prescriber_id, patient_id, drug and dose. Layers
+        0-2 are evaluated as column operations over the whole batch; only
+        rows that pass them run the per-row Layer 3 check. Returns one row
+        per input with the same fields and layer details as
+        analyze_prescription (apart from the timestamp).
+        """
+        columns = ['prescriber_id', 'patient_id', 'drug', 'dose']
+        batch = batch[columns].reset_index(drop=True)
+        
+        if self.prescribers_df is None or self.patients_df is None:
+            return pd.DataFrame([
+                self.analyze_prescription(*row)
+                for row in batch.itertuples(index=False)
+            ])
+        
+        prescriber_ids = batch['prescriber_id'].astype(str)
+        patient_ids = batch['patient_id'].astype(str)
+        drugs = batch['drug'].astype(str)
+        doses = batch['dose'].astype(float)
+        
+        # Layer 0: Doctor Authorization
+        prescribers = self.prescribers_df.drop_duplicates('doctor_id').set_index('doctor_id')
+        status = prescriber_ids.map(prescribers['credentialing_status'])
+        prescriber_found = prescriber_ids.isin(prescribers.index)
+        status_ok = prescriber_ids.map(prescribers['status_active']).eq(True)
+        dea_ok = prescriber_ids.map(prescribers['dea_valid']).eq(True)
+        layer0_passed = prescriber_found & status_ok & dea_ok
+        layer0_message = np.select(
+            [~prescriber_found, ~status_ok, ~dea_ok],
+            [
+                'Prescriber ' + prescriber_ids + ' not found in database',
+                'Prescriber status: ' + status.astype(str),
+                'Invalid DEA number format'
+            ],
+            default='Prescriber ' + prescriber_ids.map(prescribers['name']).astype(str) + ' authorized'
+        )
+        
+        # Layer 1: Patient Validation
+        patients = self.patients_df.drop_duplicates('patient_id').set_index('patient_id')
+        layer1_passed = patient_ids.isin(patients.index)
+        layer1_message = np.where(
+            layer1_passed,
+            'Patient ' + patient_ids.map(patients['name']).astype(str) + ' found',
+            'Patient ' + patient_ids + ' not found'
+        )
+        
+        # Layer 2: Drug Safety
+        drug_lower = drugs.str.lower().str.strip()
+        illegal = drug_lower.isin(_ILLEGAL_DRUGS)
+        max_dose = drug_lower.map(_SAFE_DOSE_LIMITS)
+        dose_bad = max_dose.notna() & (doses > max_dose)
+        layer2_passed = ~illegal & ~dose_bad
+        layer2_message = np.select(
+            [illegal, dose_bad],
+            [
+                "Drug '" + drugs + "' is illegal/controlled substance",
+                'Dose ' + doses.astype(str) + 'mg exceeds safe limit of '
+                + max_dose.astype('Int64').astype(str) + 'mg'
+            ],
+            default="Drug '" + drugs + "' at " + doses.astype(str) + 'mg is safe'
+        )
+        
+        # First failing layer per row (4 = all of layers 0-2 passed)
+        failed_layer = np.select(
+            [~layer0_passed, ~layer1_passed, ~layer2_passed], [0, 1, 2], default=4
+        )
+        
+        # Layer 3: Contraindication Detection over encoded arrays; only
+        # rows that passed layers 0-2 are reported
+        codes = self._patient_codes.reindex(patient_ids.to_numpy()).fillna(0)
+        layer3_reasons = _layer3_kernel(
+            drug_lower.map(_LAYER3_DRUG_CODES).fillna(0).to_numpy(np.int64),
+            codes['liver'].to_numpy(np.int64),
+            codes['kidney'].to_numpy(np.int64),
+            codes['conditions'].to_numpy(np.int64),
+            codes['medications'].to_numpy(np.int64)
+        )
+        
+        timestamp = datetime.now()
+        records = []
+        for i, row in enumerate(batch.itertuples(index=False)):
+            stage = int(failed_layer[i])
+            prescriber_data = self.prescribers_by_id.get(prescriber_ids.iat[i])
+            patient_data = self.patients_by_id.get(patient_ids.iat[i])
+            
+            # Layer details, as the per-layer methods report them
+            if layer0_passed.iat[i]:
+                details0 = _prescriber_details(prescriber_data)
+            elif prescriber_data is not None and not status_ok.iat[i]:
+                details0 = {
+                    "status": prescriber_data['credentialing_status'],
+                    "name": prescriber_data['name']
+                }
+            else:
+                details0 = {}
+            details1 = _patient_details(patient_data) if patient_data is not None else {}
+            if illegal.iat[i]:
+                details2 = {}
+            elif dose_bad.iat[i]:
+                details2 = {
+                    "drug": row.drug,
+                    "dose": row.dose,
+                    "max_safe_dose": _SAFE_DOSE_LIMITS[drug_lower.iat[i]]
+                }
+            else:
+                details2 = {"drug": row.drug, "dose": row.dose, "status": "valid"}
+            
+            layers = [
+                {"passed": bool(layer0_passed.iat[i]), "message": layer0_message[i], "details": details0},
+                {"passed": bool(layer1_passed.iat[i]), "message": layer1_message[i], "details": details1},
+                {"passed": bool(layer2_passed.iat[i]), "message": layer2_message[i], "details": details2},
+                None
+            ]
+            if stage == 4:
+                layers[3] = _contraindication_result(
+                    int(layer3_reasons[i]), row.drug, patient_data
+                )
+                if not layers[3]["passed"]:
+                    stage = 3
+            for k in range(stage + 1, 4):
+                layers[k] = _SKIPPED[stage]
+            
+            approved = stage == 4
+            result = _make_response(
+                approved, *row, *layers, _SAFETY_SCORES[stage],
+                _APPROVED_REASON if approved else layers[stage]["message"]
+            )
+            records.append(result)
+        
+        self._record_analyses(len(records), sum(r["approved"] for r in records))
+        
+        results = pd.DataFrame(records, columns=list(_RESULT_KEYS[:-1]))
+        # Object dtype keeps plain datetime values rather than pd.Timestamp
+        results['timestamp'] = pd.Series([timestamp] * len(results), index=results.index, dtype=object)
+        return results
     
     # ============== UTILITY METHODS ==============
     
+    def _record_analyses(self, analyses: int, approved: int):
+        """Atomically add to the analysis/approval counters"""
+        with self._stats_lock:
+            self.analysis_count += analyses
+            self.approved_count += approved
+    
     def get_patient(self, patient_id: str) -> Optional[Dict]:
         """Get patient details"""
         try:
-            if self.patients_df is None:
-                return None
-            
-            patient = self.patients_df[
-                self.patients_df['patient_id'] == patient_id
-            ]
-            
-            if patient.empty:
+            patient_data = self.patients_by_id.get(patient_id)
+            if patient_data is None:
                 return None
             
-            patient_data = patient.iloc[0]
-            return patient_data.to_dict()
+            return {
+                k: v for k, v in patient_data.items()
+                if k not in _DERIVED_PATIENT_KEYS
+            }
         except:
             return None
     
     def get_prescriber(self, prescriber_id: str) -> Optional[Dict]:
         """Get prescriber details"""
         try:
-            if self.prescribers_df is None:
-                return None
-            
-            prescriber = self.prescribers_df[
-                self.prescribers_df['doctor_id'] == prescriber_id
-            ]
-            
-            if prescriber.empty:
+            prescriber_data = self.prescribers_by_id.get(prescriber_id)
+            if prescriber_data is None:
                 return None
             
-            prescriber_data = prescriber.iloc[0]
-            return prescriber_data.to_dict()
+            return {
+                k: v for k, v in prescriber_data.items()
+                if k not in _DERIVED_PRESCRIBER_KEYS
+            }
         except:
             return None
     
     def get_statistics(self) -> Dict[str, Any]:
         """Get system statistics"""
         try:
-            total_prescribers = len(self.prescribers_df) if self.prescribers_df is not None else 0
-            total_patients = len(self.patients_df) if self.patients_df is not None else 0
+            with self._stats_lock:
+                analysis_count = self.analysis_count
+                approved_count = self.approved_count
             
             return {
-                "total_prescribers": total_prescribers,
-                "total_patients": total_patients,
-                "total_analyses": self.analysis_count,
-                "approved_count": self.approved_count,
-                "denied_count": self.analysis_count - self.approved_count,
-                "approval_rate": f"{(self.approved_count/max(self.analysis_count, 1)*100):.1f}%"
+                "total_prescribers": self._total_prescribers,
+                "total_patients": self._total_patients,
+                "total_analyses": analysis_count,
+                "approved_count": approved_count,
+                "denied_count": analysis_count - approved_count,
+                "approval_rate": f"{(approved_count/max(analysis_count, 1)*100):.1f}%"
             }
         except:
             return {
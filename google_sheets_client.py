@@ -3,8 +3,31 @@ Google Sheets Client - Integration with Google Sheets API
 Allows pulling prescriber and patient data from Google Sheets
 """
 
+import atexit
+import functools
+import json
+import logging
+import queue
+import threading
+import time
+import weakref
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
 import gspread
+from gspread.utils import absolute_range_name
+from cachetools import TTLCache
+from tenacity import (
+    retry,
+    retry_if_exception,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
+from google.auth.transport.requests import AuthorizedSession
 from google.oauth2.service_account import Credentials
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import List, Dict, Optional
 import pandas as pd
 import os
@@ -13,6 +36,143 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
+# Calling threads only enqueue log records; a listener thread writes them
+_log = logging.getLogger(__name__)
+_log.setLevel(logging.INFO)
+_log.propagate = False
+_log_queue = queue.Queue(-1)
+_log.addHandler(QueueHandler(_log_queue))
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+_log_listener = QueueListener(_log_queue, _log_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+# Spreadsheet holding the Prescribers, Patients and Audit Log worksheets
+SHEET_NAME = os.getenv('SHEET_NAME', 'Medical Prescription Firewall')
+
+# Rosters change on an hour scale, so reads are reused for a few minutes
+READ_CACHE_TTL = 300
+
+# Audit decisions are written to this local JSONL file first, then
+# uploaded to the Audit Log worksheet in the background
+AUDIT_LOG_PATH = os.getenv('AUDIT_LOG_PATH', 'audit_log.jsonl')
+AUDIT_COLUMNS = ('timestamp', 'prescriber_id', 'patient_id', 'drug', 'dose', 'status', 'reason')
+# Seconds between background uploads of buffered rows, so a partial
+# batch is not held back until the next decision is logged
+AUDIT_FLUSH_INTERVAL = 30
+
+# One worker keeps uploads ordered and off the caller's thread
+_UPLOAD_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix='audit-upload')
+_audit_file = None
+_audit_file_lock = threading.Lock()
+
+# Live clients whose buffered audit rows are uploaded at exit. Held weakly,
+# so a client that is replaced and dropped isn't kept alive by the hook.
+_audit_clients = weakref.WeakSet()
+
+
+def _flush_all_audits():
+    """Upload the buffered audit rows of every live client"""
+    for client in list(_audit_clients):
+        client.flush_audit()
+
+
+atexit.register(_flush_all_audits)
+
+_audit_flusher = None
+_audit_flusher_lock = threading.Lock()
+
+
+def _flush_audits_periodically():
+    """Queue an upload of every client's buffered rows each AUDIT_FLUSH_INTERVAL"""
+    while True:
+        time.sleep(AUDIT_FLUSH_INTERVAL)
+        try:
+            _UPLOAD_POOL.submit(_flush_all_audits)
+        except RuntimeError:
+            # The pool is shut down at interpreter exit
+            return
+
+
+def _start_audit_flusher():
+    """Start the background flush thread, once per process"""
+    global _audit_flusher
+    with _audit_flusher_lock:
+        if _audit_flusher is None:
+            _audit_flusher = threading.Thread(
+                target=_flush_audits_periodically, name='audit-flush', daemon=True
+            )
+            _audit_flusher.start()
+
+
+def _write_audit_line(record: Dict):
+    """Append one audit record to the local JSONL log"""
+    global _audit_file
+    line = json.dumps(record, default=str) + '\n'
+    with _audit_file_lock:
+        if _audit_file is None:
+            _audit_file = open(AUDIT_LOG_PATH, 'a', encoding='utf-8')
+        _audit_file.write(line)
+        _audit_file.flush()
+
+
+# Worksheets read together when syncing the rosters
+ROSTER_WORKSHEETS = ['Prescribers', 'Patients']
+
+# Local Parquet snapshots used by the sync_* helpers
+SNAPSHOT_DIR = os.path.expanduser(os.getenv('MQF_CACHE_DIR', '~/.mqf_cache'))
+SNAPSHOT_TTL = int(os.getenv('MQF_CACHE_TTL', '3600'))
+
+# HTTP statuses worth retrying: rate limiting and transient server errors
+RETRY_STATUS_CODES = {429, 500, 503}
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    """True for Sheets API errors with a retryable HTTP status"""
+    if not isinstance(exc, gspread.exceptions.APIError):
+        return False
+    response = getattr(exc, 'response', None)
+    return getattr(response, 'status_code', None) in RETRY_STATUS_CODES
+
+
+_RETRY = retry(
+    wait=wait_exponential_jitter(initial=1, max=60),
+    stop=stop_after_attempt(6),
+    retry=retry_if_exception(_is_retryable),
+    reraise=True,
+)
+
+
+@_RETRY
+def _call(func, *args, **kwargs):
+    """Make a Sheets API call, backing off on quota and server errors"""
+    return func(*args, **kwargs)
+
+
+def _values_to_dataframe(values: List[List]) -> pd.DataFrame:
+    """
+    Build a DataFrame from raw sheet values (header row first).
+    
+    Sheets omits trailing empty cells, so rows are padded to the header
+    width; columns whose values are all numeric are converted in one pass.
+    """
+    if not values:
+        return pd.DataFrame()
+    
+    header = values[0]
+    width = len(header)
+    rows = [(row + [''] * (width - len(row)))[:width] for row in values[1:]]
+    df = pd.DataFrame(rows, columns=header)
+    
+    for column in df.columns:
+        try:
+            df[column] = pd.to_numeric(df[column])
+        except (ValueError, TypeError):
+            pass
+    return df
+
+
 class GoogleSheetsClient:
     """
     Client for integrating with Google Sheets.
@@ -29,13 +189,25 @@ class GoogleSheetsClient:
         self.client = None
         self.credentials_path = credentials_path or os.getenv('GOOGLE_SHEETS_CREDENTIALS_PATH')
         self.spreadsheet = None
+        # Worksheet reads, keyed by (spreadsheet id, worksheet name)
+        self._frame_cache = TTLCache(maxsize=32, ttl=READ_CACHE_TTL)
+        self._cache_lock = threading.Lock()
+        # Audit rows are buffered and written in batches to save API calls
+        self._audit_buffer: List[List] = []
+        self._audit_flush_size = 50
+        self._audit_lock = threading.Lock()
+        _audit_clients.add(self)
+        _start_audit_flusher()
+        # Cells queued by update_cell inside batch_updates(), by worksheet.
+        # Per thread: the client is shared process-wide (see _get_client)
+        self._batch_state = threading.local()
         self.initialize()
     
     def initialize(self):
         """Initialize connection to Google Sheets"""
         try:
             if not self.credentials_path:
-                print("⚠️ Google Sheets credentials not configured")
+                _log.warning("⚠️ Google Sheets credentials not configured")
                 return False
             
             # Authenticate
@@ -50,12 +222,21 @@ class GoogleSheetsClient:
                 scopes=scope
             )
             
-            self.client = gspread.authorize(credentials)
-            print("✅ Google Sheets client initialized")
+            # Pooled keep-alive connections shared by all threads using this
+            # client. Connection errors are retried here; HTTP 429/5xx are
+            # left to _RETRY so the two layers don't multiply.
+            session = AuthorizedSession(credentials)
+            session.mount('https://', HTTPAdapter(
+                pool_connections=8,
+                pool_maxsize=32,
+                max_retries=Retry(total=3, backoff_factor=0.5)
+            ))
+            self.client = gspread.Client(auth=credentials, session=session)
+            _log.info("✅ Google Sheets client initialized")
             return True
         
         except Exception as e:
-            print(f"❌ Error initializing Google Sheets: {e}")
+            _log.error(f"❌ Error initializing Google Sheets: {e}")
             return False
     
     def open_spreadsheet(self, spreadsheet_name: str):
@@ -69,12 +250,12 @@ class GoogleSheetsClient:
             if not self.client:
                 raise Exception("Client not initialized")
             
-            self.spreadsheet = self.client.open(spreadsheet_name)
-            print(f"✅ Opened spreadsheet: {spreadsheet_name}")
+            self.spreadsheet = _call(self.client.open, spreadsheet_name)
+            _log.info(f"✅ Opened spreadsheet: {spreadsheet_name}")
             return True
         
         except Exception as e:
-            print(f"❌ Error opening spreadsheet: {e}")
+            _log.error(f"❌ Error opening spreadsheet: {e}")
             return False
     
     def get_worksheet(self, worksheet_name: str):
@@ -88,16 +269,33 @@ class GoogleSheetsClient:
             if not self.spreadsheet:
                 raise Exception("No spreadsheet opened")
             
-            worksheet = self.spreadsheet.worksheet(worksheet_name)
+            worksheet = _call(self.spreadsheet.worksheet, worksheet_name)
             return worksheet
         
         except Exception as e:
-            print(f"❌ Error getting worksheet: {e}")
+            _log.error(f"❌ Error getting worksheet: {e}")
             return None
     
+    def _cache_key(self, worksheet_name: str) -> tuple:
+        """Cache key for a worksheet of the open spreadsheet"""
+        spreadsheet_id = self.spreadsheet.id if self.spreadsheet else None
+        return (spreadsheet_id, worksheet_name)
+    
+    def invalidate(self, worksheet_name: str):
+        """
+        Drop cached reads of a worksheet.
+        
+        Args:
+            worksheet_name: Name of the worksheet
+        """
+        key = self._cache_key(worksheet_name)
+        with self._cache_lock:
+            self._frame_cache.pop(key, None)
+    
     def get_all_records(self, worksheet_name: str) -> List[Dict]:
         """
         Get all records from a worksheet as list of dictionaries.
+        Results are cached for READ_CACHE_TTL seconds.
         
         Args:
             worksheet_name: Name of the worksheet
@@ -106,21 +304,22 @@ class GoogleSheetsClient:
             List of dictionaries with row data
         """
         try:
-            worksheet = self.get_worksheet(worksheet_name)
-            if not worksheet:
+            df = self.get_as_dataframe(worksheet_name)
+            if df is None:
                 return []
             
-            records = worksheet.get_all_records()
-            print(f"✅ Retrieved {len(records)} records from {worksheet_name}")
+            records = df.to_dict(orient='records')
+            _log.info(f"✅ Retrieved {len(records)} records from {worksheet_name}")
             return records
         
         except Exception as e:
-            print(f"❌ Error getting records: {e}")
+            _log.error(f"❌ Error getting records: {e}")
             return []
     
     def get_as_dataframe(self, worksheet_name: str) -> Optional[pd.DataFrame]:
         """
         Get worksheet data as pandas DataFrame.
+        Results are cached for READ_CACHE_TTL seconds.
         
         Args:
             worksheet_name: Name of the worksheet
@@ -129,19 +328,81 @@ class GoogleSheetsClient:
             DataFrame or None if error
         """
         try:
-            worksheet = self.get_worksheet(worksheet_name)
-            if not worksheet:
-                return None
+            key = self._cache_key(worksheet_name)
+            with self._cache_lock:
+                df = self._frame_cache.get(key)
+            
+            if df is None:
+                if not self.spreadsheet:
+                    raise Exception("No spreadsheet opened")
+                
+                # One values request, without gspread's per-row dict building
+                response = _call(
+                    self.spreadsheet.values_get,
+                    absolute_range_name(worksheet_name)
+                )
+                df = _values_to_dataframe(response.get('values', []))
+                with self._cache_lock:
+                    self._frame_cache[key] = df
+                _log.info(f"✅ Converted {worksheet_name} to DataFrame")
             
-            records = worksheet.get_all_records()
-            df = pd.DataFrame(records)
-            print(f"✅ Converted {worksheet_name} to DataFrame")
-            return df
+            # Copy so callers can't mutate the cached frame
+            return df.copy()
         
         except Exception as e:
-            print(f"❌ Error converting to DataFrame: {e}")
+            _log.error(f"❌ Error converting to DataFrame: {e}")
             return None
     
+    def get_many(self, worksheet_names: List[str]) -> Dict[str, List[List]]:
+        """
+        Get the raw values of several worksheets in a single request.
+        The results also fill the DataFrame cache.
+        
+        Args:
+            worksheet_names: Names of the worksheets
+        
+        Returns:
+            Mapping of worksheet name to its rows (header row first)
+        """
+        try:
+            if not self.spreadsheet:
+                raise Exception("No spreadsheet opened")
+            
+            response = _call(
+                self.spreadsheet.values_batch_get,
+                [absolute_range_name(name) for name in worksheet_names]
+            )
+            # Value ranges come back in request order
+            values = {
+                name: value_range.get('values', [])
+                for name, value_range in zip(worksheet_names, response.get('valueRanges', []))
+            }
+            frames = {name: _values_to_dataframe(rows) for name, rows in values.items()}
+            with self._cache_lock:
+                for name, df in frames.items():
+                    self._frame_cache[self._cache_key(name)] = df
+            _log.info(f"✅ Retrieved {', '.join(values)} in one request")
+            return values
+        
+        except Exception as e:
+            _log.error(f"❌ Error getting worksheets: {e}")
+            return {}
+    
+    def prefetch(self, worksheet_names: List[str]):
+        """
+        Load any worksheets not already cached with one batched request.
+        
+        Args:
+            worksheet_names: Names of the worksheets
+        """
+        with self._cache_lock:
+            missing = [
+                name for name in worksheet_names
+                if self._cache_key(name) not in self._frame_cache
+            ]
+        if missing:
+            self.get_many(missing)
+    
     def append_row(self, worksheet_name: str, values: List) -> bool:
         """
         Append a row to a worksheet.
@@ -155,12 +416,40 @@ class GoogleSheetsClient:
             if not worksheet:
                 return False
             
-            worksheet.append_row(values)
-            print(f"✅ Appended row to {worksheet_name}")
+            _call(worksheet.append_row, values)
+            self.invalidate(worksheet_name)
+            _log.info(f"✅ Appended row to {worksheet_name}")
+            return True
+        
+        except Exception as e:
+            _log.error(f"❌ Error appending row: {e}")
+            return False
+    
+    def append_rows(self, worksheet_name: str, rows: List[List]) -> bool:
+        """
+        Append several rows to a worksheet in a single API call.
+        
+        Args:
+            worksheet_name: Name of the worksheet
+            rows: List of rows, each a list of values
+        """
+        try:
+            worksheet = self.get_worksheet(worksheet_name)
+            if not worksheet:
+                return False
+            
+            _call(
+                worksheet.append_rows,
+                rows,
+                value_input_option='RAW',
+                insert_data_option='INSERT_ROWS'
+            )
+            self.invalidate(worksheet_name)
+            _log.info(f"✅ Appended {len(rows)} rows to {worksheet_name}")
             return True
         
         except Exception as e:
-            print(f"❌ Error appending row: {e}")
+            _log.error(f"❌ Error appending rows: {e}")
             return False
     
     def update_cell(
@@ -172,6 +461,7 @@ class GoogleSheetsClient:
     ) -> bool:
         """
         Update a specific cell.
+        Inside batch_updates() the update is queued instead of sent.
         
         Args:
             worksheet_name: Name of the worksheet
@@ -179,17 +469,68 @@ class GoogleSheetsClient:
             col: Column number (1-indexed)
             value: New value
         """
+        pending = getattr(self._batch_state, 'pending_cells', None)
+        if pending is not None:
+            pending[worksheet_name].append(gspread.Cell(row, col, value))
+            return True
+        
+        try:
+            worksheet = self.get_worksheet(worksheet_name)
+            if not worksheet:
+                return False
+            
+            _call(worksheet.update_cell, row, col, value)
+            self.invalidate(worksheet_name)
+            _log.info(f"✅ Updated cell [{row},{col}] in {worksheet_name}")
+            return True
+        
+        except Exception as e:
+            _log.error(f"❌ Error updating cell: {e}")
+            return False
+    
+    @contextmanager
+    def batch_updates(self):
+        """
+        Queue update_cell calls and send them as one request per worksheet.
+        
+        Only the calling thread's updates are queued. If the block raises,
+        the queued updates are discarded rather than partially applied.
+        
+        Usage:
+            with client.batch_updates():
+                client.update_cell('Prescribers', 2, 9, 'Suspended')
+                client.update_cell('Prescribers', 3, 9, 'Active')
+        """
+        state = self._batch_state
+        if getattr(state, 'pending_cells', None) is not None:
+            # Nested batch: the outermost one sends the updates
+            yield
+            return
+        
+        state.pending_cells = defaultdict(list)
+        try:
+            yield
+        except BaseException:
+            state.pending_cells = None
+            raise
+        pending, state.pending_cells = state.pending_cells, None
+        for worksheet_name, cells in pending.items():
+            self._update_cells(worksheet_name, cells)
+    
+    def _update_cells(self, worksheet_name: str, cells: List) -> bool:
+        """Send queued cell updates for one worksheet in a single call"""
         try:
             worksheet = self.get_worksheet(worksheet_name)
             if not worksheet:
                 return False
             
-            worksheet.update_cell(row, col, value)
-            print(f"✅ Updated cell [{row},{col}] in {worksheet_name}")
+            _call(worksheet.update_cells, cells, value_input_option='USER_ENTERED')
+            self.invalidate(worksheet_name)
+            _log.info(f"✅ Updated {len(cells)} cells in {worksheet_name}")
             return True
         
         except Exception as e:
-            print(f"❌ Error updating cell: {e}")
+            _log.error(f"❌ Error updating cells: {e}")
             return False
     
     def get_prescribers(self) -> List[Dict]:
@@ -212,6 +553,11 @@ class GoogleSheetsClient:
         """
         Log prescription decision to audit sheet.
         
+        The decision is appended to the local audit file right away.
+        Rows for the sheet are buffered and uploaded by a background
+        worker once the batch is full, and every AUDIT_FLUSH_INTERVAL
+        seconds otherwise; call flush_audit() to upload them sooner.
+        
         Args:
             prescriber_id: ID of prescriber
             patient_id: ID of patient
@@ -227,11 +573,39 @@ class GoogleSheetsClient:
             status = "APPROVED" if approved else "DENIED"
             
             row = [timestamp, prescriber_id, patient_id, drug, dose, status, reason]
-            return self.append_row('Audit Log', row)
+            _write_audit_line(dict(zip(AUDIT_COLUMNS, row)))
+            
+            with self._audit_lock:
+                self._audit_buffer.append(row)
+                full = len(self._audit_buffer) >= self._audit_flush_size
+            
+            if full:
+                _UPLOAD_POOL.submit(self.flush_audit)
+            return True
         
         except Exception as e:
-            print(f"❌ Error logging decision: {e}")
+            _log.error(f"❌ Error logging decision: {e}")
             return False
+    
+    def close(self):
+        """Upload buffered audit rows and stop flushing this client at exit"""
+        self.flush_audit()
+        _audit_clients.discard(self)
+    
+    def flush_audit(self) -> bool:
+        """Write all buffered audit rows to the audit sheet"""
+        with self._audit_lock:
+            rows, self._audit_buffer = self._audit_buffer, []
+        if not rows:
+            return True
+        
+        if self.append_rows('Audit Log', rows):
+            return True
+        
+        # Keep the rows for the next flush rather than dropping them
+        with self._audit_lock:
+            self._audit_buffer[:0] = rows
+        return False
 
 
 # ============== Utility Functions ==============
@@ -249,39 +623,126 @@ def create_google_sheets_client(credentials_path: Optional[str] = None) -> Googl
     return GoogleSheetsClient(credentials_path)
 
 
+@functools.lru_cache(maxsize=1)
+def _get_client(credentials_path: Optional[str] = None) -> GoogleSheetsClient:
+    """
+    Shared client with SHEET_NAME opened.
+    
+    Reused by the sync_* helpers so credentials are loaded, the token is
+    fetched and the spreadsheet is looked up only once per process.
+    """
+    client = GoogleSheetsClient(credentials_path)
+    if client.client:
+        client.open_spreadsheet(SHEET_NAME)
+    return client
+
+
+# Serializes roster prefetches so concurrent syncs share one batched read
+_prefetch_lock = threading.Lock()
+
+
+def _snapshot_path(worksheet_name: str) -> str:
+    """Path of the local Parquet snapshot for a worksheet"""
+    filename = worksheet_name.lower().replace(' ', '_') + '.parquet'
+    return os.path.join(SNAPSHOT_DIR, filename)
+
+
+def _cached_df(worksheet_name: str, ttl: int = SNAPSHOT_TTL) -> Optional[pd.DataFrame]:
+    """
+    Get a worksheet as a DataFrame, preferring the local Parquet snapshot.
+    
+    The snapshot is used as-is while younger than ttl seconds. After that the
+    spreadsheet's last update time is compared with the one stored next to
+    the snapshot, and the sheet is only downloaded again if it has changed.
+    A stale snapshot is still returned when Sheets is unavailable.
+    
+    Args:
+        worksheet_name: Name of the worksheet
+        ttl: Snapshot lifetime in seconds
+    
+    Returns:
+        DataFrame or None if neither Sheets nor a snapshot is available
+    """
+    path = _snapshot_path(worksheet_name)
+    etag_path = path + '.etag'
+    has_snapshot = os.path.exists(path)
+    
+    if has_snapshot and time.time() - os.path.getmtime(path) < ttl:
+        return pd.read_parquet(path)
+    
+    client = _get_client()
+    if not client.client or not client.spreadsheet:
+        client.close()
+        _get_client.cache_clear()  # retry the connection next time
+        return pd.read_parquet(path) if has_snapshot else None
+    
+    # Fetched from Drive on every revalidation; the lastUpdateTime property
+    # is only read once, when the spreadsheet is opened
+    try:
+        etag = _call(client.spreadsheet.get_lastUpdateTime)
+    except Exception:
+        etag = None
+    
+    if has_snapshot and etag:
+        try:
+            with open(etag_path) as f:
+                unchanged = f.read() == etag
+        except OSError:
+            unchanged = False
+        if unchanged:
+            os.utime(path)  # restart the TTL window
+            return pd.read_parquet(path)
+    
+    if has_snapshot:
+        # The sheet changed, so skip the client's cached read as well
+        client.invalidate(worksheet_name)
+    
+    if worksheet_name in ROSTER_WORKSHEETS:
+        # The first roster sync fetches both rosters in one request
+        with _prefetch_lock:
+            client.prefetch(ROSTER_WORKSHEETS)
+    
+    df = client.get_as_dataframe(worksheet_name)
+    if df is None:
+        return pd.read_parquet(path) if has_snapshot else None
+    
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        df.to_parquet(path, compression='zstd')
+        with open(etag_path, 'w') as f:
+            f.write(etag or '')
+    except Exception as e:
+        _log.warning(f"⚠️ Could not write snapshot for {worksheet_name}: {e}")
+    return df
+
+
 def sync_prescribers_from_sheets() -> Optional[pd.DataFrame]:
     """
     Sync prescriber data from Google Sheets to local DataFrame.
+    Served from the local snapshot while it is fresh.
     
     Returns:
         DataFrame with prescriber data or None
     """
     try:
-        client = GoogleSheetsClient()
-        if not client.client:
-            return None
-        
-        return client.get_as_dataframe('Prescribers')
+        return _cached_df('Prescribers')
     except Exception as e:
-        print(f"❌ Error syncing prescribers: {e}")
+        _log.error(f"❌ Error syncing prescribers: {e}")
         return None
 
 
 def sync_patients_from_sheets() -> Optional[pd.DataFrame]:
     """
     Sync patient data from Google Sheets to local DataFrame.
+    Served from the local snapshot while it is fresh.
     
     Returns:
         DataFrame with patient data or None
     """
     try:
-        client = GoogleSheetsClient()
-        if not client.client:
-            return None
-        
-        return client.get_as_dataframe('Patients')
+        return _cached_df('Patients')
     except Exception as e:
-        print(f"❌ Error syncing patients: {e}")
+        _log.error(f"❌ Error syncing patients: {e}")
         return None
 
 
@@ -295,7 +756,7 @@ if __name__ == "__main__":
     
     if client.client:
         # Open spreadsheet
-        client.open_spreadsheet("Medical Prescription Firewall")
+        client.open_spreadsheet(SHEET_NAME)
         
         # Get prescriber data
         prescribers = client.get_prescribers()
@@ -5,18 +5,33 @@ Interactive tester for 4-layer prescription safety analysis
 
 import streamlit as st
 import pandas as pd
+import pyarrow.parquet as pq
 from datetime import datetime
 import sys
 import os
+import re
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from data_io import read_excel, to_categorical
 
-# Try to import firewall_engine
-try:
+# Import and load firewall_engine once per process, shared by all sessions.
+# A failed load raises, so it is not cached and the next rerun retries.
+@st.cache_resource(show_spinner=False)
+def _load_firewall():
     from firewall_engine import PrescriptionFirewall
-    firewall = PrescriptionFirewall()
-    has_firewall = True
-except:
-    firewall = None
-    has_firewall = False
+    engine = PrescriptionFirewall()
+    engine.initialize()
+    if engine.prescribers_df is None or engine.patients_df is None:
+        raise RuntimeError("firewall_engine could not load the rosters")
+    return engine
+
+
+def _get_firewall():
+    """Initialized PrescriptionFirewall, or None if the engine is unavailable"""
+    try:
+        return _load_firewall()
+    except Exception:
+        return None
 
 # Page config
 st.set_page_config(
@@ -26,27 +41,181 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Custom CSS
-st.markdown("""
-<style>
-    .approved { color: #28a745; font-weight: bold; }
-    .blocked { color: #dc3545; font-weight: bold; }
-    .warning { color: #ffc107; font-weight: bold; }
-    .info { color: #17a2b8; font-weight: bold; }
-    .layer-passed { border-left: 4px solid #28a745; padding: 10px; margin: 5px 0; background-color: #f0f8f5; }
-    .layer-failed { border-left: 4px solid #dc3545; padding: 10px; margin: 5px 0; background-color: #f8f0f0; }
-    .metric-box { padding: 15px; border-radius: 5px; background-color: #f5f5f5; margin: 10px 0; }
-</style>
-""", unsafe_allow_html=True)
+firewall = _get_firewall()
+has_firewall = firewall is not None
+
+# Custom CSS (read once per process; the mtime argument picks up edits).
+# Resolved next to this file so the app can be launched from any directory.
+CSS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'custom.css')
+
+
+@st.cache_resource(show_spinner=False)
+def _css(path, mtime):
+    """Stylesheet contents, or "" if it cannot be read (the page renders unstyled)"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return f.read()
+    except OSError:
+        return ""
+
+def _mtime(path):
+    """Modification time of path, or 0 if it cannot be read"""
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0
+
+_custom_css = _css(CSS_PATH, _mtime(CSS_PATH))
+if _custom_css:
+    st.markdown(f"<style>{_custom_css}</style>", unsafe_allow_html=True)
 
 # ============== LOAD DATA ==============
 
-@st.cache_data
+# Roster columns the dashboard reads; the rest are dropped at load time.
+# Any liver/kidney column is kept too, since _organ_column picks from those.
+PRESCRIBER_COLUMNS = ('doctor_id', 'name', 'credentialing_status')
+PATIENT_COLUMNS = (
+    'patient_id', 'name', 'age', 'conditions', 'medications',
+    'liver_status', 'kidney_status'
+)
+ORGANS = ('liver', 'kidney')
+
+# Low-cardinality text columns stored as pandas categories
+PRESCRIBER_CATEGORY_COLUMNS = ('credentialing_status',)
+PATIENT_CATEGORY_COLUMNS = ('liver_status', 'kidney_status')
+
+
+# Organ status flags read by the contraindication rules:
+# flag -> (organ, pattern matched against the lowercased status)
+ORGAN_FLAGS = {
+    'liver_impaired': ('liver', re.compile(r'severe|impaired')),
+    'kidney_severe': ('kidney', re.compile(r'severe')),
+    'kidney_diseased': ('kidney', re.compile(r'impaired|disease')),
+    'kidney_impaired': ('kidney', re.compile(r'impaired|severe')),
+}
+
+
+def _organ_column(df, organ):
+    """Name of the organ status column (last match, as the checks always used)"""
+    matches = [col for col in df.columns if organ in col.lower()]
+    return matches[-1] if matches else None
+
+
+def _index_positions(df, id_col):
+    """Map each ID (as a string) to the position of its first row"""
+    positions = {}
+    for i, value in enumerate(df[id_col].values):
+        positions.setdefault(str(value), i)
+    return positions
+
+
+class _RowLookup:
+    """
+    ID -> row lookup over the columns the dashboard reads.
+    
+    Rows are returned as plain dicts read from a 2-D object array, so no
+    Series is built per lookup. Kept in df.attrs, which pandas deep-copies
+    on most operations; the lookup is read-only, so copies share it.
+    """
+    
+    def __init__(self, df, id_col, columns):
+        self.columns = tuple(col for col in dict.fromkeys(columns) if col in df.columns)
+        # Missing cells read as NaN, not pd.NA, so truthiness checks keep working
+        self.values = df[list(self.columns)].to_numpy(dtype=object, na_value=float('nan'))
+        self.positions = _index_positions(df, id_col)
+        # Selectbox options, built once instead of on every rerun
+        labels = df['__label__'].tolist()
+        self.options = ("Select",) + tuple(labels)
+        # Option label -> ID, so a selection needs no string parsing
+        self.label_ids = {}
+        for label, value in zip(labels, df[id_col].values):
+            self.label_ids.setdefault(label, str(value))
+    
+    def __deepcopy__(self, memo):
+        return self
+    
+    def row(self, key):
+        """Fields of the first row with this ID, or None"""
+        position = self.positions.get(str(key))
+        if position is None:
+            return None
+        return dict(zip(self.columns, self.values[position]))
+
+
+def _keep_prescriber_column(col):
+    return col in PRESCRIBER_COLUMNS
+
+
+def _keep_patient_column(col):
+    return col in PATIENT_COLUMNS or any(organ in col.lower() for organ in ORGANS)
+
+
+def _read_roster(name, keep):
+    """
+    Read a roster from its Parquet copy, or the .xlsx if that is missing or stale.
+    
+    Only the columns accepted by keep(column_name) are read. They come back
+    Arrow-backed, so text is stored as columnar UTF-8 rather than one
+    Python object per cell.
+    """
+    parquet_path = f"{name}.parquet"
+    xlsx_path = f"{name}.xlsx"
+    if os.path.exists(parquet_path) and (
+        not os.path.exists(xlsx_path)
+        or os.path.getmtime(parquet_path) >= os.path.getmtime(xlsx_path)
+    ):
+        columns = [col for col in pq.read_schema(parquet_path).names if keep(col)]
+        return pd.read_parquet(
+            parquet_path, engine='pyarrow', columns=columns, dtype_backend='pyarrow'
+        )
+    return read_excel(xlsx_path, usecols=keep).convert_dtypes(dtype_backend='pyarrow')
+
+
+# Shared by all sessions rather than copied per rerun; cache_resource
+# neither hashes nor pickles the returned frames
+@st.cache_resource(show_spinner=False)
 def load_data():
-    """Load prescriber and patient data from Excel files"""
+    """Load prescriber and patient data (Parquet, falling back to Excel)"""
     try:
-        prescribers = pd.read_excel('medical_prescribers_50.xlsx')
-        patients = pd.read_excel('medical_patients_100.xlsx')
+        prescribers = _read_roster('medical_prescribers_50', _keep_prescriber_column)
+        patients = _read_roster('medical_patients_100', _keep_patient_column)
+        # Display labels for the selectboxes
+        prescribers['__label__'] = prescribers['doctor_id'].astype(str).str.cat(
+            prescribers['name'].astype(str), sep=" — "
+        )
+        patients['__label__'] = patients['patient_id'].astype(str).str.cat(
+            patients['name'].astype(str), sep=" — "
+        )
+        # Resolve the organ status columns once and pre-lowercase them
+        for organ in ORGANS:
+            col = _organ_column(patients, organ)
+            patients.attrs[f'{organ}_col'] = col
+            if col is not None:
+                patients[col] = patients[col].astype(str).str.lower()
+        # Evaluate the organ conditions for every patient at once
+        for flag, (organ, pattern) in ORGAN_FLAGS.items():
+            col = patients.attrs[f'{organ}_col']
+            patients[flag] = (
+                patients[col].str.contains(pattern, na=False)
+                if col is not None else False
+            )
+        # Repeated text values as categories, age as a small integer
+        to_categorical(prescribers, PRESCRIBER_CATEGORY_COLUMNS)
+        to_categorical(patients, PATIENT_CATEGORY_COLUMNS)
+        if 'age' in patients.columns:
+            patients['age'] = pd.to_numeric(patients['age'], downcast='integer')
+        # Content hashes key the cached analyses to this data version
+        for df in (prescribers, patients):
+            df.attrs['version'] = int(pd.util.hash_pandas_object(df, index=True).sum())
+        # ID -> row fields, so row lookups are a dict probe and an array read
+        prescribers.attrs['rows'] = _RowLookup(
+            prescribers, 'doctor_id', ('credentialing_status',)
+        )
+        patients.attrs['rows'] = _RowLookup(
+            patients, 'patient_id',
+            ('age', 'conditions', 'medications', 'liver_status', 'kidney_status',
+             patients.attrs['liver_col'], *ORGAN_FLAGS)
+        )
         return prescribers, patients
     except:
         return None, None
@@ -55,6 +224,13 @@ prescribers_df, patients_df = load_data()
 
 # ============== HELPER FUNCTIONS ==============
 
+# First number in a dose string ("10mg", "2.5 mg", ".5")
+_DOSE_RE = re.compile(r'\d*\.?\d+')
+# Separators between the ID and name in a display label, in priority
+# order; a bare "-" is not one, since IDs may contain hyphens
+_LABEL_SEPARATORS = ("—", "|", " - ", " ")
+
+
 def extract_id_from_label(label_string, dataframe, id_col):
     """
     Extract the actual ID from a display label.
@@ -67,20 +243,22 @@ def extract_id_from_label(label_string, dataframe, id_col):
     if not label_string:
         return None
     
-    # Split on the separator (—, -, |, or whitespace)
-    for sep in ["—", "-", "|", " "]:
-        if sep in str(label_string):
-            id_part = str(label_string).split(sep)[0].strip()
-            if id_part and id_part != "":
+    # Split on the first separator that leaves a non-empty ID
+    text = str(label_string).strip()
+    for sep in _LABEL_SEPARATORS:
+        if sep in text:
+            id_part = text.partition(sep)[0].strip()
+            if id_part:
                 return id_part
     
-    return str(label_string).strip()
+    return text
 
 
 def get_selected_patient_row(patient_id, patients_df, id_col="patient_id"):
     """
     Get the ACTUAL selected patient row from dataframe.
     NOT iloc[0] — use the patient_id to find the correct row.
+    Returns a dict of the dashboard's fields when load_data built a lookup.
     """
     if patients_df is None or patients_df.empty:
         return None
@@ -88,6 +266,10 @@ def get_selected_patient_row(patient_id, patients_df, id_col="patient_id"):
     if patient_id is None:
         return None
     
+    rows = patients_df.attrs.get('rows')
+    if rows is not None:
+        return rows.row(patient_id)
+    
     # Find the row matching the patient_id
     matching_rows = patients_df[patients_df[id_col].astype(str) == str(patient_id)]
     
@@ -100,6 +282,7 @@ def get_selected_patient_row(patient_id, patients_df, id_col="patient_id"):
 def get_selected_prescriber_row(prescriber_id, prescribers_df, id_col="doctor_id"):
     """
     Get the ACTUAL selected prescriber row from dataframe.
+    Returns a dict of the dashboard's fields when load_data built a lookup.
     """
     if prescribers_df is None or prescribers_df.empty:
         return None
@@ -107,6 +290,10 @@ def get_selected_prescriber_row(prescriber_id, prescribers_df, id_col="doctor_id
     if prescriber_id is None:
         return None
     
+    rows = prescribers_df.attrs.get('rows')
+    if rows is not None:
+        return rows.row(prescriber_id)
+    
     matching_rows = prescribers_df[prescribers_df[id_col].astype(str) == str(prescriber_id)]
     
     if matching_rows.empty:
@@ -117,79 +304,227 @@ def get_selected_prescriber_row(prescriber_id, prescribers_df, id_col="doctor_id
 
 def parse_dose(dose_str):
     """Parse dose string and extract numeric value"""
-    try:
-        # Extract all digits and decimal point
-        dose_num = ''.join(c for c in str(dose_str) if c.isdigit() or c == '.')
-        if dose_num:
-            return float(dose_num)
-        return 10.0
-    except:
-        return 10.0
+    # Thousands separators would otherwise split the number
+    match = _DOSE_RE.search(str(dose_str).replace(',', ''))
+    return float(match.group()) if match else 10.0
 
 
+# Illegal/controlled substances, blocked outright. Same list and the same
+# exact-name match as the engine's Layer 2.
+BLOCKED_DRUGS = frozenset({'heroin', 'fentanyl_street', 'meth', 'cocaine', 'pcp'})
+
+# Maximum safe single dose (mg) by lowercase drug name
+_SAFE_DOSES = {
+    'oxycodone': 50,
+    'morphine': 100,
+    'hydrocodone': 40,
+    'codeine': 60,
+    'paracetamol': 1000,
+    'ibuprofen': 800,
+    'aspirin': 500,
+    'metformin': 2550,
+    'lisinopril': 40,
+    'atenolol': 100,
+    'vitamin_d': 4000,
+    'atorvastatin': 80,
+    'amlodipine': 10,
+    'albuterol': 200,
+    'insulin': 300
+}
+
+
+@functools.lru_cache(maxsize=256)
 def get_safe_dose_limit(drug):
     """Get safe dose limit for a drug"""
-    limits = {
-        'oxycodone': 50,
-        'morphine': 100,
-        'hydrocodone': 40,
-        'codeine': 60,
-        'paracetamol': 1000,
-        'ibuprofen': 800,
-        'aspirin': 500,
-        'metformin': 2550,
-        'lisinopril': 40,
-        'atenolol': 100,
-        'vitamin_d': 4000,
-        'atorvastatin': 80,
-        'amlodipine': 10,
-        'albuterol': 200,
-        'insulin': 300
-    }
-    return limits.get(drug.lower(), None)
+    return _SAFE_DOSES.get(drug.lower(), None)
 
 
-def check_contraindications(selected_patient, drug, patients_df):
-    """Check for drug-disease and organ contraindications"""
+def _opioid_rules(drug, patient, liver_status):
+    """Opioids: liver impairment and severe kidney disease"""
+    found = []
+    if patient.get('liver_impaired'):
+        found.append(f"⚠️ {drug} contraindicated with {liver_status} liver disease")
+    if patient.get('kidney_severe'):
+        found.append(f"⚠️ {drug} contraindicated with severe kidney disease")
+    return found
+
+
+def _nsaid_rules(drug, patient, liver_status):
+    """NSAIDs: any kidney impairment or disease"""
+    if patient.get('kidney_diseased'):
+        return [f"⚠️ NSAIDs contraindicated with kidney disease"]
+    return []
+
+
+def _metformin_rules(drug, patient, liver_status):
+    """Metformin: impaired or severe kidney function"""
+    if patient.get('kidney_impaired'):
+        return [f"⚠️ Metformin contraindicated with kidney impairment"]
+    return []
+
+
+# Contraindication rules by lowercase drug name
+DRUG_RULES = {
+    'oxycodone': _opioid_rules,
+    'morphine': _opioid_rules,
+    'hydrocodone': _opioid_rules,
+    'codeine': _opioid_rules,
+    'aspirin': _nsaid_rules,
+    'ibuprofen': _nsaid_rules,
+    'metformin': _metformin_rules,
+}
+
+
+def check_contraindications(selected_patient, drug, liver_col, drug_key=None):
+    """
+    Check for drug-disease and organ contraindications.
+    
+    The organ conditions come from the ORGAN_FLAGS fields that load_data
+    precomputes per patient; liver_col names the (lowercased) liver status
+    column used in messages, and may be None. drug_key is the normalized
+    drug name, if the caller already has it.
+    """
     if selected_patient is None:
         return True, "No patient data"
     
-    contraindications = []
-    
-    # Get organ status columns
-    liver_status = None
-    kidney_status = None
+    if drug_key is None:
+        drug_key = drug.lower().strip()
+    rules = DRUG_RULES.get(drug_key)
+    if rules is None:
+        return True, "No contraindications detected"
     
-    for col in patients_df.columns:
-        if "liver" in col.lower():
-            liver_status = str(selected_patient.get(col, "")).lower()
-        if "kidney" in col.lower():
-            kidney_status = str(selected_patient.get(col, "")).lower()
+    liver_status = str(selected_patient.get(liver_col, "")) if liver_col else None
     
-    drug_lower = drug.lower().strip()
+    contraindications = rules(drug, selected_patient, liver_status)
+    if contraindications:
+        return False, " | ".join(contraindications)
     
-    # OPIOID CONTRAINDICATIONS
-    if drug_lower in ['oxycodone', 'morphine', 'hydrocodone', 'codeine']:
-        if liver_status and ("severe" in liver_status or "impaired" in liver_status):
-            contraindications.append(f"⚠️ {drug} contraindicated with {liver_status} liver disease")
-        
-        if kidney_status and "severe" in kidney_status:
-            contraindications.append(f"⚠️ {drug} contraindicated with severe kidney disease")
+    return True, "No contraindications detected"
+
+
+@st.cache_data(max_entries=512, ttl=600)
+def _analyze_impl(presc_id, pat_id, drug, dose, _prescribers_df, _patients_df,
+                  prescribers_version, patients_version):
+    """
+    Run the fallback 4-layer analysis.
     
-    # NSAID CONTRAINDICATIONS
-    if drug_lower in ['aspirin', 'ibuprofen']:
-        if kidney_status and ("impaired" in kidney_status or "disease" in kidney_status):
-            contraindications.append(f"⚠️ NSAIDs contraindicated with kidney disease")
+    Pure function of its inputs, so repeat clicks are served from the cache.
+    DataFrames are not hashed; the version arguments identify the data.
+    """
+    selected_patient = get_selected_patient_row(pat_id, _patients_df, "patient_id")
+    selected_prescriber = get_selected_prescriber_row(presc_id, _prescribers_df, "doctor_id")
+    
+    # Normalize the drug name once for every table lookup below
+    drug_key = drug.lower().strip()
+    
+    result = {
+        "approved": True,
+        "prescriber_id": presc_id,
+        "patient_id": pat_id,
+        "drug": drug,
+        "dose": dose,
+        "layer0": {"passed": True, "message": "✅ Prescriber authorized"},
+        "layer1": {"passed": True, "message": "✅ Patient found"},
+        "layer2": {"passed": True, "message": "✅ Drug valid"},
+        "layer3": {"passed": True, "message": "✅ No contraindications"},
+        "safety_score": 100,
+        "reason": "✅ APPROVED - All checks passed"
+    }
     
-    # METFORMIN CONTRAINDICATIONS
-    if drug_lower == 'metformin':
-        if kidney_status and ("impaired" in kidney_status or "severe" in kidney_status):
-            contraindications.append(f"⚠️ Metformin contraindicated with kidney impairment")
+    # Layer 0: Check prescriber
+    if selected_prescriber is not None:
+        status = selected_prescriber.get('credentialing_status', 'Unknown')
+        if status != 'Active':
+            result["approved"] = False
+            result["layer0"]["passed"] = False
+            result["layer0"]["message"] = f"❌ Prescriber status: {status}"
+            result["safety_score"] = 0
     
-    if contraindications:
-        return False, " | ".join(contraindications)
+    # Layer 1: Check patient
+    if selected_patient is None:
+        result["approved"] = False
+        result["layer1"]["passed"] = False
+        result["layer1"]["message"] = "❌ Patient not found"
+        result["safety_score"] = 0
+    
+    # Layer 2: Check drug safety
+    safe_limit = get_safe_dose_limit(drug_key)
+    if drug_key in BLOCKED_DRUGS:
+        result["approved"] = False
+        result["layer2"]["passed"] = False
+        result["layer2"]["message"] = f"❌ Drug '{drug}' is illegal/controlled substance"
+        result["safety_score"] = 25
+    elif safe_limit and dose > safe_limit:
+        result["approved"] = False
+        result["layer2"]["passed"] = False
+        result["layer2"]["message"] = f"❌ Dose {dose}mg exceeds safe limit of {safe_limit}mg"
+        result["safety_score"] = 25
+    
+    # Layer 3: Check contraindications (using selected_patient)
+    if result["approved"] and selected_patient is not None:
+        safe, contra_msg = check_contraindications(
+            selected_patient, drug, _patients_df.attrs.get('liver_col'), drug_key
+        )
+        if not safe:
+            result["approved"] = False
+            result["layer3"]["passed"] = False
+            result["layer3"]["message"] = contra_msg
+            result["safety_score"] = 25
     
-    return True, "No contraindications detected"
+    return result
+
+
+# Result key and display title of each firewall layer
+LAYER_TITLES = (
+    ("layer0", "Layer 0 - Doctor Authorization"),
+    ("layer1", "Layer 1 - Patient Validation"),
+    ("layer2", "Layer 2 - Drug Safety"),
+    ("layer3", "Layer 3 - Contraindication Detection"),
+)
+
+
+# Seconds the UI waits for the engine before showing an error. This only
+# bounds the wait: a timed-out call keeps running on its pool thread until
+# it finishes, since a running future cannot be cancelled.
+ENGINE_TIMEOUT = 30
+
+
+# Shared by all sessions; the script thread waits on it for at most ENGINE_TIMEOUT
+@st.cache_resource(show_spinner=False)
+def _engine_executor():
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="firewall")
+
+
+def _run_engine(presc_id, pat_id, drug, dose):
+    """Analyze with the real firewall_engine; None (with an error shown) if it fails"""
+    future = _engine_executor().submit(
+        firewall.analyze_prescription,
+        prescriber_id=presc_id,
+        patient_id=pat_id,
+        drug=drug,
+        dose=dose
+    )
+    try:
+        return future.result(timeout=ENGINE_TIMEOUT)
+    except TimeoutError:
+        st.error(f"Firewall engine timed out after {ENGINE_TIMEOUT}s")
+        return None
+    except Exception as e:
+        st.error(f"Error in firewall engine: {str(e)}")
+        return None
+
+
+def _run_fallback(presc_id, pat_id, drug, dose):
+    """Fallback: cached analysis using the selected rows"""
+    return {
+        **_analyze_impl(
+            presc_id, pat_id, drug, dose,
+            prescribers_df, patients_df,
+            prescribers_df.attrs.get('version'),
+            patients_df.attrs.get('version')
+        ),
+        "timestamp": datetime.now().isoformat()
+    }
 
 
 # ============== SIDEBAR ==============
@@ -228,6 +563,51 @@ with st.sidebar:
 
 # ============== MAIN CONTENT ==============
 
+# Static About-tab text, built once at import rather than on every rerun
+ABOUT_MARKDOWN = """
+### How It Works
+
+**4-Layer Prescription Firewall:**
+
+**Layer 0: Doctor Authorization**
+- Verifies doctor exists in database
+- Checks DEA number is valid
+- Confirms license is active (not suspended/revoked)
+- Validates prescribing privileges
+
+**Layer 1: Patient Validation**
+- Confirms patient exists
+- Loads medical history
+- Retrieves current medications
+- Checks organ function status
+
+**Layer 2: Drug Safety**
+- Validates drug is legal/approved
+- Checks dosage is within safe limits
+- Blocks dangerous drug combinations
+- Verifies proper strength/formulation
+
+**Layer 3: Contraindication Detection**
+- Checks drug-disease interactions
+- Detects drug-drug conflicts
+- Considers organ function
+- High-risk combination warnings
+
+### Data Sources
+
+- **Prescribers:** 50 doctors from medical_prescribers_50.xlsx
+- **Patients:** 100 patients from medical_patients_100.xlsx
+- **Safety Rules:** Evidence-based medical guidelines
+
+### Safety Scoring
+
+- **100/100:** All layers pass - safe to prescribe
+- **75/100:** Minor warnings - prescriber review recommended
+- **50/100:** Significant concerns - contraindication detected
+- **0-25/100:** Critical issue - prescription blocked
+"""
+
+
 st.title("🛡️ Medical Prescription Firewall v3.0")
 st.markdown("**Real-time prescription safety analysis with 4-layer verification**")
 
@@ -240,57 +620,57 @@ with tab1:
     if prescribers_df is None or patients_df is None:
         st.error("❌ Unable to load data files. Please ensure medical_prescribers_50.xlsx and medical_patients_100.xlsx are available.")
     else:
-        # Create display versions with labels
-        prescribers_df['__label__'] = prescribers_df.apply(
-            lambda row: f"{row['doctor_id']} — {row['name']}", axis=1
-        )
-        patients_df['__label__'] = patients_df.apply(
-            lambda row: f"{row['patient_id']} — {row['name']}", axis=1
-        )
-        
-        # Input columns
-        col1, col2, col3, col4 = st.columns(4)
-        
-        with col1:
-            presc_choice = st.selectbox(
-                "Select Doctor",
-                ["Select"] + prescribers_df['__label__'].tolist(),
-                key="prescriber"
-            )
-        
-        with col2:
-            pat_choice = st.selectbox(
-                "Select Patient",
-                ["Select"] + patients_df['__label__'].tolist(),
-                key="patient"
-            )
+        # Inputs are submitted together, so editing them does not rerun the page
+        with st.form("rx_form"):
+            # Input columns
+            col1, col2, col3, col4 = st.columns(4)
+            
+            with col1:
+                presc_choice = st.selectbox(
+                    "Select Doctor",
+                    prescribers_df.attrs['rows'].options,
+                    key="prescriber"
+                )
+            
+            with col2:
+                pat_choice = st.selectbox(
+                    "Select Patient",
+                    patients_df.attrs['rows'].options,
+                    key="patient"
+                )
+            
+            with col3:
+                drug_input = st.text_input(
+                    "Drug Name",
+                    value="Oxycodone",
+                    key="drug"
+                )
+            
+            with col4:
+                dose_input = st.text_input(
+                    "Dose (mg)",
+                    value="10",
+                    key="dose"
+                )
+            
+            st.divider()
+            
+            # Analyze button
+            col1, col2, col3 = st.columns([2, 1, 2])
+            
+            with col2:
+                submitted = st.form_submit_button("🔍 Analyze Prescription", use_container_width=True)
         
-        with col3:
-            drug_input = st.text_input(
-                "Drug Name",
-                value="Oxycodone",
-                key="drug"
+        if submitted:
+            # Map the selected labels to IDs (parsing only unknown labels)
+            presc_id = (
+                prescribers_df.attrs['rows'].label_ids.get(presc_choice)
+                or extract_id_from_label(presc_choice, prescribers_df, "doctor_id")
             )
-        
-        with col4:
-            dose_input = st.text_input(
-                "Dose (mg)",
-                value="10",
-                key="dose"
+            pat_id = (
+                patients_df.attrs['rows'].label_ids.get(pat_choice)
+                or extract_id_from_label(pat_choice, patients_df, "patient_id")
             )
-        
-        st.divider()
-        
-        # Analyze button
-        col1, col2, col3 = st.columns([2, 1, 2])
-        
-        with col2:
-            analyze_btn = st.button("🔍 Analyze Prescription", use_container_width=True)
-        
-        if analyze_btn:
-            # Extract actual IDs from labels
-            presc_id = extract_id_from_label(presc_choice, prescribers_df, "doctor_id")
-            pat_id = extract_id_from_label(pat_choice, patients_df, "patient_id")
             
             drug = drug_input.strip() if drug_input else "Oxycodone"
             dose = parse_dose(dose_input)
@@ -298,73 +678,15 @@ with tab1:
             if presc_id is None or pat_id is None:
                 st.error("❌ Please select both a doctor and patient")
             else:
-                # ===== GET SELECTED ROWS (NOT iloc[0]) =====
+                # ===== GET SELECTED ROW (NOT iloc[0]) =====
                 selected_patient = get_selected_patient_row(pat_id, patients_df, "patient_id")
-                selected_prescriber = get_selected_prescriber_row(presc_id, prescribers_df, "doctor_id")
                 
                 with st.spinner("Analyzing prescription..."):
                     # Run analysis
-                    if has_firewall and firewall is not None:
-                        # Use the real firewall_engine
-                        try:
-                            result = firewall.analyze_prescription(
-                                prescriber_id=presc_id,
-                                patient_id=pat_id,
-                                drug=drug,
-                                dose=dose
-                            )
-                        except Exception as e:
-                            st.error(f"Error in firewall engine: {str(e)}")
-                            result = None
+                    if has_firewall:
+                        result = _run_engine(presc_id, pat_id, drug, dose)
                     else:
-                        # Fallback: Build result using selected rows
-                        result = {
-                            "approved": True,
-                            "prescriber_id": presc_id,
-                            "patient_id": pat_id,
-                            "drug": drug,
-                            "dose": dose,
-                            "layer0": {"passed": True, "message": "✅ Prescriber authorized"},
-                            "layer1": {"passed": True, "message": "✅ Patient found"},
-                            "layer2": {"passed": True, "message": "✅ Drug valid"},
-                            "layer3": {"passed": True, "message": "✅ No contraindications"},
-                            "safety_score": 100,
-                            "reason": "✅ APPROVED - All checks passed",
-                            "timestamp": datetime.now().isoformat()
-                        }
-                        
-                        # Layer 0: Check prescriber
-                        if selected_prescriber is not None:
-                            status = selected_prescriber.get('credentialing_status', 'Unknown')
-                            if status != 'Active':
-                                result["approved"] = False
-                                result["layer0"]["passed"] = False
-                                result["layer0"]["message"] = f"❌ Prescriber status: {status}"
-                                result["safety_score"] = 0
-                        
-                        # Layer 1: Check patient
-                        if selected_patient is None:
-                            result["approved"] = False
-                            result["layer1"]["passed"] = False
-                            result["layer1"]["message"] = "❌ Patient not found"
-                            result["safety_score"] = 0
-                        
-                        # Layer 2: Check drug safety
-                        safe_limit = get_safe_dose_limit(drug)
-                        if safe_limit and dose > safe_limit:
-                            result["approved"] = False
-                            result["layer2"]["passed"] = False
-                            result["layer2"]["message"] = f"❌ Dose {dose}mg exceeds safe limit of {safe_limit}mg"
-                            result["safety_score"] = 25
-                        
-                        # Layer 3: Check contraindications (using selected_patient)
-                        if result["approved"] and selected_patient is not None:
-                            safe, contra_msg = check_contraindications(selected_patient, drug, patients_df)
-                            if not safe:
-                                result["approved"] = False
-                                result["layer3"]["passed"] = False
-                                result["layer3"]["message"] = contra_msg
-                                result["safety_score"] = 25
+                        result = _run_fallback(presc_id, pat_id, drug, dose)
                     
                     if result:
                         st.divider()
@@ -383,29 +705,15 @@ with tab1:
                         # Layer Details
                         st.subheader("Layer Analysis")
                         
-                        # Layer 0
-                        if result["layer0"]["passed"]:
-                            st.markdown(f'<div class="layer-passed">✅ <b>Layer 0 - Doctor Authorization:</b> {result["layer0"]["message"]}</div>', unsafe_allow_html=True)
-                        else:
-                            st.markdown(f'<div class="layer-failed">❌ <b>Layer 0 - Doctor Authorization:</b> {result["layer0"]["message"]}</div>', unsafe_allow_html=True)
-                        
-                        # Layer 1
-                        if result["layer1"]["passed"]:
-                            st.markdown(f'<div class="layer-passed">✅ <b>Layer 1 - Patient Validation:</b> {result["layer1"]["message"]}</div>', unsafe_allow_html=True)
-                        else:
-                            st.markdown(f'<div class="layer-failed">❌ <b>Layer 1 - Patient Validation:</b> {result["layer1"]["message"]}</div>', unsafe_allow_html=True)
-                        
-                        # Layer 2
-                        if result["layer2"]["passed"]:
-                            st.markdown(f'<div class="layer-passed">✅ <b>Layer 2 - Drug Safety:</b> {result["layer2"]["message"]}</div>', unsafe_allow_html=True)
-                        else:
-                            st.markdown(f'<div class="layer-failed">❌ <b>Layer 2 - Drug Safety:</b> {result["layer2"]["message"]}</div>', unsafe_allow_html=True)
-                        
-                        # Layer 3
-                        if result["layer3"]["passed"]:
-                            st.markdown(f'<div class="layer-passed">✅ <b>Layer 3 - Contraindication Detection:</b> {result["layer3"]["message"]}</div>', unsafe_allow_html=True)
-                        else:
-                            st.markdown(f'<div class="layer-failed">❌ <b>Layer 3 - Contraindication Detection:</b> {result["layer3"]["message"]}</div>', unsafe_allow_html=True)
+                        # All four layers in one element instead of one per layer
+                        layer_html = []
+                        for key, title in LAYER_TITLES:
+                            layer = result[key]
+                            css, icon = ("layer-passed", "✅") if layer["passed"] else ("layer-failed", "❌")
+                            layer_html.append(
+                                f'<div class="{css}">{icon} <b>{title}:</b> {layer["message"]}</div>'
+                            )
+                        st.markdown("\n".join(layer_html), unsafe_allow_html=True)
                         
                         st.divider()
                         
@@ -456,48 +764,7 @@ with tab2:
 with tab3:
     st.subheader("ℹ️ System Information")
     
-    st.markdown("""
-    ### How It Works
-    
-    **4-Layer Prescription Firewall:**
-    
-    **Layer 0: Doctor Authorization**
-    - Verifies doctor exists in database
-    - Checks DEA number is valid
-    - Confirms license is active (not suspended/revoked)
-    - Validates prescribing privileges
-    
-    **Layer 1: Patient Validation**
-    - Confirms patient exists
-    - Loads medical history
-    - Retrieves current medications
-    - Checks organ function status
-    
-    **Layer 2: Drug Safety**
-    - Validates drug is legal/approved
-    - Checks dosage is within safe limits
-    - Blocks dangerous drug combinations
-    - Verifies proper strength/formulation
-    
-    **Layer 3: Contraindication Detection**
-    - Checks drug-disease interactions
-    - Detects drug-drug conflicts
-    - Considers organ function
-    - High-risk combination warnings
-    
-    ### Data Sources
-    
-    - **Prescribers:** 50 doctors from medical_prescribers_50.xlsx
-    - **Patients:** 100 patients from medical_patients_100.xlsx
-    - **Safety Rules:** Evidence-based medical guidelines
-    
-    ### Safety Scoring
-    
-    - **100/100:** All layers pass - safe to prescribe
-    - **75/100:** Minor warnings - prescriber review recommended
-    - **50/100:** Significant concerns - contraindication detected
-    - **0-25/100:** Critical issue - prescription blocked
-    """)
+    st.markdown(ABOUT_MARKDOWN)
 
 st.divider()
 st.markdown("---")
@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+
+@pytest.fixture(scope="session")
+def firewall():
+    """PrescriptionFirewall loaded from the bundled rosters"""
+    from firewall_engine import PrescriptionFirewall
+    
+    cwd = os.getcwd()
+    os.chdir(REPO_ROOT)
+    try:
+        engine = PrescriptionFirewall()
+        engine.initialize()
+    finally:
+        os.chdir(cwd)
+    assert engine.prescribers_df is not None and engine.patients_df is not None
+    return engine
+
+
+@pytest.fixture(scope="session")
+def dashboard():
+    """streamlit_app imported in Streamlit's bare mode (no server)"""
+    pytest.importorskip("streamlit")
+    import importlib
+    
+    cwd = os.getcwd()
+    os.chdir(REPO_ROOT)
+    try:
+        return importlib.import_module("streamlit_app")
+    finally:
+        os.chdir(cwd)
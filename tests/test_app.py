@@ -0,0 +1,78 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import app as api
+
+
+@pytest.fixture
+def client(firewall, monkeypatch):
+    monkeypatch.setattr(api, "firewall", firewall)
+    return TestClient(api.app)
+
+
+def test_bulk_analyze_reports_failures_per_item(client, firewall, monkeypatch, caplog):
+    analyze_prescription = firewall.analyze_prescription
+    
+    def fail_batch(batch):
+        raise ValueError("batch failed")
+    
+    def fail_one(prescriber_id, patient_id, drug, dose):
+        if drug == "broken":
+            raise ValueError("bad item")
+        return analyze_prescription(prescriber_id, patient_id, drug, dose)
+    
+    monkeypatch.setattr(firewall, "analyze_batch", fail_batch)
+    monkeypatch.setattr(firewall, "analyze_prescription", fail_one)
+    prescriber_id = next(iter(firewall.prescribers_by_id))
+    patient_id = next(iter(firewall.patients_by_id))
+    items = [
+        {"prescriber_id": prescriber_id, "patient_id": patient_id, "drug": "aspirin", "dose": 100.0},
+        {"prescriber_id": prescriber_id, "patient_id": patient_id, "drug": "broken", "dose": 1.0},
+    ]
+    
+    response = client.post("/bulk-analyze", json=items)
+    
+    assert response.status_code == 200
+    ok, failed = response.json()
+    assert ok["drug"] == "aspirin" and "layer0" in ok
+    assert failed == {"error": "bad item", "request": items[1]}
+    # The batch failure is logged with its traceback, not swallowed
+    [record] = [r for r in caplog.records if r.name == api.__name__]
+    assert record.exc_info and str(record.exc_info[1]) == "batch failed"
+
+
+@pytest.mark.parametrize("drug, dose", [("aspirin", 100.0), ("heroin", 1.0), ("oxycodone", 500.0)])
+def test_analyze_prescription_returns_engine_result(client, firewall, drug, dose):
+    prescriber_id = next(iter(firewall.prescribers_by_id))
+    patient_id = next(iter(firewall.patients_by_id))
+    item = {"prescriber_id": prescriber_id, "patient_id": patient_id, "drug": drug, "dose": dose}
+    
+    response = client.post("/analyze-prescription", json=item)
+    
+    assert response.status_code == 200
+    body = response.json()
+    expected = firewall.analyze_prescription(prescriber_id, patient_id, drug, dose)
+    assert body.pop("timestamp")
+    expected.pop("timestamp")
+    assert body == expected
+
+
+def test_bulk_analyze_matches_single_endpoint(client, firewall):
+    prescriber_ids = list(firewall.prescribers_by_id)[:3]
+    patient_ids = list(firewall.patients_by_id)[:3] + ["P_MISSING"]
+    items = [
+        {"prescriber_id": prescriber_id, "patient_id": patient_id, "drug": drug, "dose": 100.0}
+        for prescriber_id in prescriber_ids
+        for patient_id in patient_ids
+        for drug in ("aspirin", "metformin", "heroin")
+    ]
+    
+    response = client.post("/bulk-analyze", json=items)
+    
+    assert response.status_code == 200
+    results = response.json()
+    assert len(results) == len(items)
+    for item, result in zip(items, results):
+        single = client.post("/analyze-prescription", json=item).json()
+        assert result.pop("timestamp") and single.pop("timestamp")
+        assert result == single
@@ -0,0 +1,164 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import data_io
+import firewall_engine
+from conftest import REPO_ROOT
+
+DRUGS = [
+    'Oxycodone', ' morphine ', 'codeine', 'aspirin', 'Ibuprofen',
+    'metformin', 'insulin', 'heroin', 'unknown_drug'
+]
+DOSES = [10.0, 75.0, 900.0, 5000.0]
+
+
+def _without_timestamp(result):
+    return {k: v for k, v in result.items() if k != 'timestamp'}
+
+
+def test_batch_matches_single_analysis(firewall):
+    prescriber_ids = list(firewall.prescribers_by_id) + ['DOC_MISSING']
+    patient_ids = list(firewall.patients_by_id) + ['P_MISSING']
+    rows = [
+        (prescriber_id, patient_id, drug, dose)
+        for prescriber_id in prescriber_ids[::3]
+        for patient_id in patient_ids[::2]
+        for drug in DRUGS
+        for dose in DOSES
+    ]
+    batch = pd.DataFrame(rows, columns=['prescriber_id', 'patient_id', 'drug', 'dose'])
+    
+    results = firewall.analyze_batch(batch).to_dict(orient='records')
+    
+    assert len(results) == len(rows)
+    for row, batch_result in zip(rows, results):
+        single = firewall.analyze_prescription(*row)
+        assert _without_timestamp(batch_result) == _without_timestamp(single), row
+
+
+def test_profiles_return_full_records(firewall):
+    patient_id = next(iter(firewall.patients_by_id))
+    prescriber_id = next(iter(firewall.prescribers_by_id))
+    
+    patient = firewall.get_patient(patient_id)
+    prescriber = firewall.get_prescriber(prescriber_id)
+    
+    assert {'allergies', 'gender', 'notes', 'liver_status', 'kidney_status'} <= patient.keys()
+    assert {'license_type', 'privileges', 'specialty', 'license_number'} <= prescriber.keys()
+    assert 'conditions_set' not in patient and 'status_active' not in prescriber
+
+
+@pytest.mark.parametrize("kernel", [
+    firewall_engine._layer3_kernel,
+    getattr(firewall_engine._layer3_kernel, 'py_func', firewall_engine._layer3_kernel),
+], ids=["compiled", "python"])
+def test_layer3_kernel_matches_layer3_method(firewall, kernel):
+    drugs = list(firewall_engine._LAYER3_DRUG_CODES) + ['insulin']
+    pairs = [(pid, drug) for pid in firewall.patients_by_id for drug in drugs]
+    codes = firewall._patient_codes.loc[[pid for pid, _ in pairs]]
+    
+    reasons = kernel(
+        np.array([firewall_engine._LAYER3_DRUG_CODES.get(drug, 0) for _, drug in pairs], dtype=np.int64),
+        codes['liver'].to_numpy(np.int64),
+        codes['kidney'].to_numpy(np.int64),
+        codes['conditions'].to_numpy(np.int64),
+        codes['medications'].to_numpy(np.int64)
+    )
+    
+    for (pid, drug), code in zip(pairs, reasons):
+        expected = firewall.layer3_contraindication_detection(pid, drug, 10.0)
+        record = firewall.patients_by_id[pid]
+        assert firewall_engine._contraindication_result(int(code), drug, record) == expected, (pid, drug)
+
+
+def test_kernel_failure_keeps_data_and_falls_back(monkeypatch):
+    def broken_kernel(*arrays):
+        raise RuntimeError("no compiler")
+    broken_kernel.py_func = firewall_engine._layer3_kernel
+    monkeypatch.setattr(firewall_engine, '_layer3_kernel', broken_kernel)
+    monkeypatch.chdir(REPO_ROOT)
+    
+    engine = firewall_engine.PrescriptionFirewall()
+    engine.initialize()
+    
+    assert engine.prescribers_df is not None and engine.patients_df is not None
+    assert firewall_engine._layer3_kernel is broken_kernel.py_func
+
+
+def test_loads_from_parquet_without_xlsx(tmp_path):
+    source = data_io.read_excel(os.path.join(REPO_ROOT, firewall_engine.PATIENTS_XLSX))
+    parquet_path = tmp_path / 'patients.parquet'
+    source.to_parquet(parquet_path)
+    
+    df = firewall_engine._load_table(str(tmp_path / 'missing.xlsx'), str(parquet_path))
+    
+    assert len(df) == len(source)
+    assert list(df.columns) == list(source.columns)
+
+
+def test_rebuilds_parquet_cache_in_place(tmp_path):
+    xlsx_path = tmp_path / 'patients.xlsx'
+    xlsx_path.write_bytes(open(os.path.join(REPO_ROOT, firewall_engine.PATIENTS_XLSX), 'rb').read())
+    parquet_path = tmp_path / 'patients.parquet'
+    
+    df = firewall_engine._load_table(str(xlsx_path), str(parquet_path))
+    
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['patients.parquet', 'patients.xlsx']
+    assert pd.read_parquet(parquet_path, dtype_backend='pyarrow').equals(df)
+
+
+def _engine_with(patients):
+    """PrescriptionFirewall over one active prescriber and the given patients"""
+    engine = firewall_engine.PrescriptionFirewall()
+    engine.prescribers_df = pd.DataFrame([{
+        'doctor_id': 'DOC001', 'name': 'Dr. Test', 'specialty': 'Internal Medicine',
+        'credentialing_status': 'Active', 'dea_number': 'AB1234567'
+    }])
+    engine.patients_df = pd.DataFrame(patients)
+    engine._build_indexes()
+    return engine
+
+
+def _patient(patient_id, conditions, medications):
+    return {
+        'patient_id': patient_id, 'name': 'Test Patient', 'age': 50,
+        'conditions': conditions, 'medications': medications,
+        'liver_status': 'normal', 'kidney_status': 'normal'
+    }
+
+
+@pytest.mark.parametrize("conditions", ["copd; kidney_disease", "Asthma; CKD_stage3", " Kidney_Disease "])
+def test_nsaids_blocked_for_kidney_disease_in_any_position(conditions):
+    engine = _engine_with([_patient('P1', conditions, 'vitamin_d')])
+    
+    result = engine.analyze_prescription('DOC001', 'P1', 'ibuprofen', 200.0)
+    
+    assert result['layer3']['details']['reason'] == 'nsaid_kidney_disease'
+
+
+def test_aspirin_blocked_for_warfarin_in_any_position():
+    engine = _engine_with([_patient('P1', 'copd', 'Atorvastatin; Warfarin')])
+    
+    result = engine.analyze_prescription('DOC001', 'P1', 'aspirin', 100.0)
+    
+    assert result['layer3']['details']['reason'] == 'drug_drug_interaction'
+
+
+def test_details_list_normalized_items():
+    engine = _engine_with([
+        _patient('P1', 'COPD; Diabetes', 'Metformin ; Insulin'),
+        _patient('P2', None, None),
+    ])
+    
+    found = engine.analyze_prescription('DOC001', 'P1', 'lisinopril', 10.0)
+    missing = engine.analyze_prescription('DOC001', 'P2', 'lisinopril', 10.0)
+    
+    assert found['layer1']['details']['conditions'] == ['copd', 'diabetes']
+    assert found['layer1']['details']['medications'] == ['metformin', 'insulin']
+    assert found['layer3']['details']['conditions'] == ['copd', 'diabetes']
+    assert missing['layer1']['details']['conditions'] == []
+    assert missing['layer1']['details']['medications'] == []
+    assert missing['layer3']['details']['conditions'] == []
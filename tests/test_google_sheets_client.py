@@ -0,0 +1,130 @@
+import threading
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("gspread")
+pytest.importorskip("tenacity")
+
+import google_sheets_client as gsc
+
+
+class FakeWorksheet:
+    def __init__(self):
+        self.cells = []
+        self.batches = []
+    
+    def update_cell(self, row, col, value):
+        self.cells.append((row, col, value))
+    
+    def update_cells(self, cells, value_input_option=None):
+        self.batches.append([(c.row, c.col, c.value) for c in cells])
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.delenv('GOOGLE_SHEETS_CREDENTIALS_PATH', raising=False)
+    client = gsc.GoogleSheetsClient()
+    worksheet = FakeWorksheet()
+    monkeypatch.setattr(client, 'get_worksheet', lambda name: worksheet)
+    client.worksheet = worksheet
+    return client
+
+
+def test_batch_updates_only_queue_the_calling_thread(client):
+    with client.batch_updates():
+        client.update_cell('Prescribers', 2, 9, 'Suspended')
+        other = threading.Thread(target=client.update_cell, args=('Prescribers', 3, 9, 'Active'))
+        other.start()
+        other.join()
+        # The other thread's update is sent right away, outside the batch
+        assert client.worksheet.cells == [(3, 9, 'Active')]
+    
+    assert client.worksheet.batches == [[(2, 9, 'Suspended')]]
+
+
+def test_batch_updates_are_dropped_when_the_block_raises(client):
+    with pytest.raises(RuntimeError):
+        with client.batch_updates():
+            client.update_cell('Prescribers', 2, 9, 'Suspended')
+            raise RuntimeError("abort")
+    
+    assert client.worksheet.batches == []
+    # Later updates are sent directly again
+    client.update_cell('Prescribers', 4, 9, 'Active')
+    assert client.worksheet.cells == [(4, 9, 'Active')]
+
+
+def test_exit_flush_does_not_keep_clients_alive(monkeypatch):
+    import gc
+    import weakref
+    
+    monkeypatch.delenv('GOOGLE_SHEETS_CREDENTIALS_PATH', raising=False)
+    client = gsc.GoogleSheetsClient()
+    ref = weakref.ref(client)
+    assert client in gsc._audit_clients
+    
+    del client
+    gc.collect()
+    
+    assert ref() is None
+
+
+def test_buffered_audit_rows_are_uploaded_without_new_decisions(client, monkeypatch):
+    uploaded = threading.Event()
+    monkeypatch.setattr(gsc, '_write_audit_line', lambda record: None)
+    monkeypatch.setattr(client, 'append_rows', lambda name, rows: uploaded.set() or True)
+    monkeypatch.setattr(gsc, 'AUDIT_FLUSH_INTERVAL', 0.05)
+    monkeypatch.setattr(gsc, '_audit_flusher', None)
+    gsc._start_audit_flusher()
+    
+    client.log_prescription_decision('DOC001', 'P001', 'aspirin', 100.0, True, 'ok')
+    
+    # A single row never fills the batch; the timer uploads it
+    assert uploaded.wait(timeout=5)
+    assert client._audit_buffer == []
+
+
+class FakeSpreadsheet:
+    def __init__(self, modified_times):
+        self.modified_times = iter(modified_times)
+    
+    def get_lastUpdateTime(self):
+        return next(self.modified_times)
+
+
+class FakeSyncClient:
+    """Stands in for the shared client used by _cached_df"""
+    
+    def __init__(self, modified_times):
+        self.client = object()
+        self.spreadsheet = FakeSpreadsheet(modified_times)
+        self.fetches = 0
+        self.cached = None
+    
+    def prefetch(self, worksheet_names):
+        pass
+    
+    def invalidate(self, worksheet_name):
+        self.cached = None
+    
+    def get_as_dataframe(self, worksheet_name):
+        if self.cached is None:
+            self.fetches += 1
+            self.cached = pd.DataFrame({'version': [self.fetches]})
+        return self.cached.copy()
+
+
+def test_cached_df_refetches_when_the_sheet_changes(tmp_path, monkeypatch):
+    fake = FakeSyncClient(['2026-01-01T00:00:00Z', '2026-01-01T00:00:00Z', '2026-01-02T00:00:00Z'])
+    monkeypatch.setattr(gsc, 'SNAPSHOT_DIR', str(tmp_path))
+    monkeypatch.setattr(gsc, '_get_client', lambda: fake)
+    
+    first = gsc._cached_df('Prescribers', ttl=0)
+    unchanged = gsc._cached_df('Prescribers', ttl=0)
+    changed = gsc._cached_df('Prescribers', ttl=0)
+    
+    assert first['version'].tolist() == [1]
+    assert unchanged['version'].tolist() == [1]
+    assert changed['version'].tolist() == [2]
+    assert fake.fetches == 2
@@ -0,0 +1,42 @@
+import pytest
+
+
+@pytest.mark.parametrize("label, expected", [
+    ("DOC001 — Dr. Smith", "DOC001"),
+    ("DOC-001 — Dr X", "DOC-001"),
+    ("P-042 | Sarah Davis", "P-042"),
+    ("P-042 - Sarah Davis", "P-042"),
+    ("P042 Sarah", "P042"),
+    ("P-042", "P-042"),
+])
+def test_extract_id_from_label(dashboard, label, expected):
+    assert dashboard.extract_id_from_label(label, None, "patient_id") == expected
+
+
+@pytest.mark.parametrize("label", ["Select", "", None])
+def test_extract_id_from_label_without_selection(dashboard, label):
+    assert dashboard.extract_id_from_label(label, None, "patient_id") is None
+
+
+def test_failed_engine_load_is_retried(dashboard, tmp_path, monkeypatch):
+    from conftest import REPO_ROOT
+    
+    dashboard._load_firewall.clear()
+    try:
+        monkeypatch.chdir(tmp_path)  # no rosters here
+        assert dashboard._get_firewall() is None
+        
+        monkeypatch.chdir(REPO_ROOT)
+        assert dashboard._get_firewall() is not None
+    finally:
+        dashboard._load_firewall.clear()
+
+
+@pytest.mark.parametrize("drug", ["heroin", " Heroin ", "heroin hcl", "street heroin", "aspirin"])
+def test_fallback_blocks_the_same_drugs_as_the_engine(dashboard, firewall, drug):
+    prescriber_id = dashboard.prescribers_df['doctor_id'].iloc[0]
+    patient_id = dashboard.patients_df['patient_id'].iloc[0]
+    
+    fallback = dashboard._run_fallback(prescriber_id, patient_id, drug, 1.0)
+    
+    assert fallback["layer2"]["passed"] == firewall.layer2_drug_safety(drug, 1.0)["passed"]